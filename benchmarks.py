@@ -0,0 +1,292 @@
+"""
+Benchmarks for the e-paper display library
+==============================================
+
+Run on the Raspberry Pi with the display attached
+
+    python benchmarks.py boot
+
+Benchmarks
+-----------
+
+boot  : time from starting a new Python process to the first frame
+        being on the screen, for cold starts (no state file) and
+        warm starts (state file left by the previous run)
+
+codec : encode/decode time and compression ratio of frame_codec on
+        a sequence of dashboard frames (no display needed)
+
+lut   : refresh busy time of each LUT preset in lut_lib
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# ===================================
+# Imports
+# ===================================
+import os
+import sys
+import time
+import random
+import tempfile
+import subprocess
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ===================================
+# Boot to first frame
+# ===================================
+
+# Script run in a new process for each boot measurement
+# Prints times for: import, EPD() creation, first frame, warm start flag
+BOOT_SCRIPT = '''
+import sys,time
+t0 = time.time()
+from waveshare_epd_lib import EPD
+t1 = time.time()
+epd = EPD(state_file=sys.argv[1] or None)
+t2 = time.time()
+if not epd.warm_start:
+    epd.clear_screen()
+epd.text((10,100),time.strftime('%H:%M:%S'),fontsize=20)
+epd.update()
+t3 = time.time()
+print('%f %f %f %d' % (t1-t0,t2-t1,t3-t2,epd.warm_start))
+'''
+
+
+def time_boot(state_file=''):
+    """
+    Time one boot of the display in a new Python process
+
+    Inputs
+    -------
+    state_file : str
+        state file to pass to EPD(), '' for no state file
+
+    Output
+    --------
+    times : dict
+        'total' : time from starting process to first frame [s]
+        'import','init','first_frame' : breakdown measured inside
+        the process [s]
+        'warm' : True if EPD() made a warm start
+    """
+    t_start = time.time()
+    proc = subprocess.Popen([sys.executable,'-c',BOOT_SCRIPT,state_file],
+                            cwd=LIB_DIR,stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    line = proc.stdout.readline()
+    t_total = time.time() - t_start
+    proc.wait()
+
+    t_import,t_init,t_frame,warm = line.split()
+    return {'total':t_total,
+            'import':float(t_import),
+            'init':float(t_init),
+            'first_frame':float(t_frame),
+            'warm':bool(int(warm))}
+
+
+def benchmark_boot(repeats=5):
+    """
+    Measure boot to first frame time for cold and warm starts
+
+    Inputs
+    -------
+    repeats : int
+        number of boots to time for each case
+    """
+    state_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    state_file = os.path.join(state_dir,'epd_benchmark_state.json')
+
+    cases = [('no state file',lambda: ''),
+             ('cold',lambda: _remove_state(state_file)),
+             ('warm',lambda: state_file)]
+
+    print('Boot to first frame [ms]')
+    print('%-14s %8s %8s %8s %8s' % ('case','total','import','init','frame'))
+
+    # Leave a state file behind for the first warm start
+    time_boot(state_file)
+
+    for label,setup in cases:
+        results = [time_boot(setup()) for i in range(repeats)]
+        mean = lambda key: 1000 * sum(r[key] for r in results) / len(results)
+        print('%-14s %8.1f %8.1f %8.1f %8.1f' % (label,mean('total'),mean('import'),
+                                                mean('init'),mean('first_frame')))
+
+    _remove_state(state_file)
+
+
+def _remove_state(state_file):
+    """
+    Delete state file so the next boot is cold, return its name
+    """
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    return state_file
+
+
+
+# ===================================
+# Frame codec
+# ===================================
+
+def dashboard_frames(n_frames=120):
+    """
+    Render a sequence of dashboard frames, one per minute
+
+    Clock, temperature reading, bar gauge and a line graph of the
+    last readings.
+
+    Output
+    --------
+    frames : list of bytes
+        packed frames
+    """
+    import screen_lib as scr
+    import waveshare_epd_lib as epd_lib
+
+    rng = random.Random(1)
+    temperature = 20.0
+    history = []
+    frames = []
+    for i in range(n_frames):
+        temperature += rng.uniform(-0.3,0.3)
+        history = (history + [temperature])[-60:]
+
+        screen = scr.Screen(epd_lib.EPD_WIDTH,epd_lib.EPD_HEIGHT)
+        screen.rect((0,0,127,249))
+        screen.text((100,10),'%02i:%02i' % (8 + i // 60,i % 60),fontsize=30)
+        screen.text((60,10),'%.1f C' % temperature,fontsize=20)
+        screen.rect((10,120,20,240))
+        screen.rect((10,240 - int(5 * (temperature - 10)),20,240),fill=0)
+        points = [(30 + int(4 * (t - 15)),120 + 2 * j) for j,t in enumerate(history)]
+        if len(points) > 1:
+            screen.line([xy for point in points for xy in point],width=1)
+        frames.append(epd_lib.pack_image(screen.image))
+
+    return frames
+
+
+def benchmark_codec(n_frames=120):
+    """
+    Measure frame_codec encode/decode time and compression ratio
+
+    Inputs
+    -------
+    n_frames : int
+        number of dashboard frames
+    """
+    import frame_codec
+
+    frames = dashboard_frames(n_frames)
+
+    encoder = frame_codec.FrameEncoder()
+    t_start = time.time()
+    records = [encoder.encode_record(frame) for frame in frames]
+    t_encode = time.time() - t_start
+
+    decoder = frame_codec.FrameDecoder()
+    t_start = time.time()
+    decoded = [decoder.decode(record) for record in records]
+    t_decode = time.time() - t_start
+    assert decoded == frames
+
+    raw_size = sum(len(frame) for frame in frames)
+    sizes = {}
+    for record in records:
+        sizes.setdefault(record.kind,[]).append(len(record.to_bytes()))
+
+    print('Frame codec, %i dashboard frames' % n_frames)
+    print('encode %8.2f ms/frame' % (1000 * t_encode / n_frames))
+    print('decode %8.2f ms/frame' % (1000 * t_decode / n_frames))
+    for kind,label in [(frame_codec.KEYFRAME,'keyframe'),
+                       (frame_codec.DELTA,'delta'),
+                       (frame_codec.REPEAT,'repeat')]:
+        if kind in sizes:
+            mean = sum(sizes[kind]) / len(sizes[kind])
+            print('%-8s %4i records, mean %7.1f bytes, ratio %6.1f' %
+                  (label,len(sizes[kind]),mean,len(frames[0]) / mean))
+    total = sum(sum(s) for s in sizes.values())
+    print('total    %i bytes from %i raw, ratio %.1f' % (total,raw_size,raw_size / total))
+
+
+
+# ===================================
+# LUT refresh time
+# ===================================
+
+def benchmark_lut(repeats=5,spi_dev=1):
+    """
+    Measure the refresh busy time of each LUT preset
+
+    Alternates between two frames so every refresh changes pixels.
+
+    Inputs
+    -------
+    repeats : int
+        refreshes for each preset
+
+    spi_dev : int
+        SPI device of display
+    """
+    import lut_lib
+    from waveshare_epd_lib import EPD
+
+    epd = EPD(spi_dev=spi_dev)
+    epd.clear_screen()
+
+    for name in lut_lib.LUT_PRESETS:
+        for i in range(repeats):
+            epd.reset_screen()
+            epd.text((10,20),'%s %i' % (name,i),fontsize=20)
+            epd.rect((10 + 10*i,150,60 + 10*i,200),fill=0)
+            epd.update(lut=name)
+
+    epd.clear_screen()
+
+    print('LUT refresh busy time [ms]')
+    print('%-16s %6s %8s %8s %8s' % ('LUT','frames','mean','min','max'))
+    for name,lut in lut_lib.LUT_PRESETS.items():
+        stats = epd.lut_stats[name]
+        print('%-16s %6i %8.1f %8.1f %8.1f' % (name,lut_lib.lut_frames(lut.data),
+                                              1000 * stats['mean_s'],
+                                              1000 * stats['min_s'],
+                                              1000 * stats['max_s']))
+
+
+
+# ===================================
+# Main
+# ===================================
+
+BENCHMARKS = {'boot':benchmark_boot,
+              'codec':benchmark_codec,
+              'lut':benchmark_lut}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print('')
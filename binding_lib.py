@@ -0,0 +1,271 @@
+"""
+Data bindings for Screen shapes
+---------------------------------
+
+Connects shapes to functions that read data (sensors, network values)
+so the screen is only redrawn when what it shows would change.
+
+Example usage
+--------------
+
+Create shapes with names
+>>> epd = EPD()
+>>> epd.text((60,10),'--',fontsize=20,name='temperature')
+>>> epd.rect((10,120,20,240),fill=0,name='bar')
+
+Bind them to data
+>>> bindings = Bindings(epd)
+>>> bindings.bind_text('temperature',read_temperature,fmt='{:.1f} C',threshold=0.2)
+>>> bindings.bind_xy('bar',read_temperature,
+...                  transform=lambda t: (10,240 - 5*t,20,240))
+
+Call on a timer, the screen is only updated when a shape has changed
+>>> bindings.update()
+>>> bindings.stats
+{'checks': 1, 'shapes_changed': 2, 'updates': 1, 'updates_avoided': 0}
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import numbers
+
+
+class Binding():
+    """
+    Connection between a data source and one property of a shape
+
+    Use Bindings.bind_text() and Bindings.bind_xy() to make these.
+    """
+
+    def __init__(self,screen,name,source,prop,render,threshold=0):
+        """
+        Inputs
+        -----------
+        screen : Screen object
+
+        name : str
+            name of shape in screen
+
+        source : function
+            called with no arguments to read the value
+
+        prop : str
+            'text' or 'xy'
+
+        render : function
+            converts value to what is drawn: a string for 'text' or
+            coordinates for 'xy'
+
+        threshold : float
+            numeric values closer than this to the value on the screen
+            are ignored [default=0]
+        """
+        self.screen = screen
+        self.name = name
+        self.source = source
+        self.prop = prop
+        self.render = render
+        self.threshold = threshold
+
+        # Value and rendered output on the screen
+        self.value = None
+        self.output = None
+
+    def __repr__(self):
+        return 'Binding(%s.%s)' % (self.name,self.prop)
+
+    def check(self):
+        """
+        Read the source and change the shape if what is drawn changes
+
+        Output
+        --------
+        changed : bool
+            True if the shape was changed
+        """
+        value = self.source()
+
+        if (self.output is not None
+            and isinstance(value,numbers.Number) and isinstance(self.value,numbers.Number)
+            and abs(value - self.value) < self.threshold):
+            return False
+
+        output = self.render(value)
+        if output == self.output:
+            # Drawn output is the same, e.g. same string after formatting
+            return False
+
+        self._apply(output)
+        self.value = value
+        self.output = output
+        return True
+
+    def _apply(self,output):
+        """
+        Change the shape
+        """
+        if self.prop == 'text':
+            # Text is drawn into an image when it is made, so the shape
+            # has to be made again with the Screen method that made it
+            params = dict(self.screen[self.name].params)
+            params['text_str'] = output
+            method = getattr(self.screen,params.pop('method'))
+            method(name=self.name,**params)
+        else:
+            self.screen.update_shape(self.name,args=[output])
+
+
+
+class Bindings():
+    """
+    Set of data bindings for a screen
+
+    Example usage
+    --------------
+
+    >>> bindings = Bindings(epd)
+    >>> bindings.bind_text('clock',lambda: time.strftime('%H:%M'))
+    >>> while True:
+    ...     bindings.update()
+    ...     time.sleep(10)
+
+    """
+
+    def __init__(self,screen):
+        """
+        Inputs
+        -----------
+        screen : Screen or EPD object
+        """
+        self.screen = screen
+        self.bindings = []
+        self.stats = {'checks':0,'shapes_changed':0,
+                      'updates':0,'updates_avoided':0}
+
+    def bind_text(self,name,source,fmt='{}',threshold=0):
+        """
+        Bind the string of a text shape to a data source
+
+        Inputs
+        -----------
+        name : str
+            name of shape made by Screen.text() or Screen.text_box()
+
+        source : function
+            called with no arguments to read the value
+
+        fmt : str or function
+            format string or function converting value to a string
+            [default='{}']
+
+        threshold : float
+            numeric values closer than this to the value on the screen
+            are ignored [default=0]
+
+        Output
+        --------
+        binding : Binding object
+        """
+        assert self.screen[name].params is not None, "Shape %s is not text" % name
+
+        if callable(fmt):
+            render = fmt
+        else:
+            render = fmt.format
+
+        return self._add(Binding(self.screen,name,source,'text',render,threshold))
+
+    def bind_xy(self,name,source,transform=None,threshold=0):
+        """
+        Bind the coordinates of a shape (rect, line, ellipse, polygon)
+        to a data source
+
+        Inputs
+        -----------
+        name : str
+            name of shape
+
+        source : function
+            called with no arguments to read the value
+
+        transform : function
+            converts value to coordinates [x1,y1,x2,y2...]
+            [default=None (source returns coordinates)]
+
+        threshold : float
+            numeric values closer than this to the value on the screen
+            are ignored [default=0]
+
+        Output
+        --------
+        binding : Binding object
+        """
+        # check shape exists
+        self.screen[name]
+
+        def render(value):
+            xy = value if transform is None else transform(value)
+            # Shapes are drawn on whole pixels
+            return tuple(int(round(v)) for v in xy)
+
+        return self._add(Binding(self.screen,name,source,'xy',render,threshold))
+
+    def refresh(self):
+        """
+        Check all bindings and change the shapes whose output changes
+
+        Output
+        --------
+        changed : bool
+            True if any shape changed
+        """
+        self.stats['checks'] += 1
+        n_changed = sum(1 for binding in self.bindings if binding.check())
+        self.stats['shapes_changed'] += n_changed
+        return n_changed > 0
+
+    def update(self,**kwargs):
+        """
+        Check all bindings and update the screen if any shape changed,
+        including shapes changed outside the bindings (e.g. a StripChart).
+        EPD.update() skips rendering when no shape has changed.
+
+        Inputs
+        -----------
+        kwargs : dict
+            passed to EPD.update(), e.g. region or lut
+
+        Output
+        --------
+        refreshed : bool
+            True if the screen was refreshed
+        """
+        self.refresh()
+        refreshed = self.screen.update(**kwargs)
+        if refreshed:
+            self.stats['updates'] += 1
+        else:
+            self.stats['updates_avoided'] += 1
+        return refreshed
+
+    def _add(self,binding):
+        self.bindings.append(binding)
+        return binding
@@ -0,0 +1,341 @@
+"""
+Chart widgets for Screen
+---------------------------------
+
+Defines the StripChart() class, a scrolling plot of sensor history that
+only draws the newest segment when a sample is added.
+
+Needs numpy.
+
+Example usage
+--------------
+
+Add chart to the top of the screen
+>>> epd = EPD()
+>>> chart = StripChart(epd,(0,0,127,63))
+
+Add samples and update only the chart band of the screen
+>>> chart.append(21.5)
+>>> if chart.dirty_region:
+...     epd.update(region=chart.dirty_region)
+...     chart.mark_clean()
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import numpy as np
+from PIL import Image,ImageDraw
+
+
+class StripChart():
+    """
+    Scrolling line plot of the most recent samples
+
+    Newest sample is on the right. Adding a sample shifts the plot left
+    and draws only the new segment, the whole plot is only redrawn
+    when the y axis range changes.
+
+    The plot is drawn in a private image and a copy is given to the
+    screen after each change, so samples can be added while another
+    thread renders the screen.
+
+    Example usage
+    --------------
+
+    >>> chart = StripChart(scr,(0,0,127,63),y_range=(0,40))
+    >>> chart.extend([20.1,20.3,20.2])
+    >>> chart.append(20.4)
+    >>> chart.dirty_region
+    (0, 0, 127, 63)
+
+    """
+
+    def __init__(self,screen,xy,step=2,y_range=None,
+                 width=1,fill=0,margin=0.1,shrink_ratio=0.25,name=None):
+        """
+        Add chart to a screen
+
+        Inputs
+        -----------
+        screen : Screen object
+            screen to draw chart on
+
+        xy: list of int
+            x,y coordinates of two corners of the chart
+            [x1,y1,x2,y2]
+
+        step : int
+            pixels between samples [default=2]
+
+        y_range : tuple or None
+            (min,max) of y axis, values outside are clipped.
+            [default=None (scale to fit the samples)]
+
+        width : int
+            width of line in pixels [default=1]
+
+        fill : int
+            line colour [default=0 (black)]
+
+        margin : float
+            when scaling to fit, fraction of the sample range added above
+            and below so the range does not change with every sample
+            [default=0.1]
+
+        shrink_ratio : float
+            when scaling to fit, the range is shrunk when the samples
+            cover less than this fraction of it [default=0.25]
+
+        name : str
+            name of shape in screen [default=None (chart<n>)]
+        """
+        x1,y1,x2,y2 = xy
+        self.screen = screen
+        self.xy = (x1,y1,x2,y2)
+        self.plot_width = x2 - x1 + 1
+        self.plot_height = y2 - y1 + 1
+        self.step = step
+        self.fixed_range = y_range
+        self.y_range = y_range
+        self.line_width = width
+        self.fill = fill
+        self.margin = margin
+        self.shrink_ratio = shrink_ratio
+
+        # Ring buffer of visible samples, oldest first from self._head
+        self.capacity = (self.plot_width - 1) // step + 1
+        self.samples = np.full(self.capacity,np.nan)
+        self._head = 0
+
+        self.image = Image.new('1',(self.plot_width,self.plot_height),255)
+        self._draw = ImageDraw.Draw(self.image)
+        self.redraw_count = 0
+        self.dirty = True
+
+        if name is None:
+            name = 'chart%i' % screen.shape_counter
+        self.name = name
+        screen.paste(self.image.copy(),(x1,y1),name=name)
+
+
+    @property
+    def values(self):
+        """
+        Visible samples, oldest first
+
+        Output
+        --------
+        values : numpy array
+            NaN where there is no sample yet
+        """
+        return np.concatenate((self.samples[self._head:],self.samples[:self._head]))
+
+
+    @property
+    def dirty_region(self):
+        """
+        Region of the screen changed since mark_clean()
+
+        Output
+        --------
+        region : tuple or None
+            (x_start,y_start,x_end,y_end) of the chart with x rounded
+            out to whole bytes, for EPD.update(region=...).
+            None if the chart has not changed. Check for None
+            before passing it to EPD.update(), where region=None
+            means the whole screen.
+        """
+        if not self.dirty:
+            return None
+        x1,y1,x2,y2 = self.xy
+        return (x1 & ~7,y1,x2 | 7,y2)
+
+
+    def mark_clean(self):
+        """
+        Mark chart as sent to the screen
+        """
+        self.dirty = False
+
+
+    def append(self,value):
+        """
+        Add a sample
+
+        Inputs
+        -----------
+        value : float
+            new sample, NaN leaves a gap
+        """
+        self.samples[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        self.dirty = True
+
+        y_range = self._fit_range()
+        if y_range != self.y_range:
+            self.y_range = y_range
+            self.redraw()
+        else:
+            self._scroll()
+            self._publish()
+
+
+    def extend(self,values):
+        """
+        Add several samples, redrawing the plot once
+
+        Inputs
+        -----------
+        values : list of float
+        """
+        values = np.asarray(values,dtype=float)[-self.capacity:]
+        for value in values:
+            self.samples[self._head] = value
+            self._head = (self._head + 1) % self.capacity
+        self.dirty = True
+
+        self.y_range = self._fit_range()
+        self.redraw()
+
+
+    def redraw(self):
+        """
+        Draw the whole plot
+        """
+        self._draw.rectangle((0,0,self.plot_width,self.plot_height),fill=255,outline=255)
+        self.redraw_count += 1
+        if self.y_range is None:
+            self._publish()
+            return
+
+        self._draw_samples(0,self.capacity)
+
+        self.dirty = True
+        self._publish()
+
+
+    def _publish(self):
+        """
+        Give the screen a copy of the plot image
+        """
+        self.screen.update_shape(self.name,args=[self.image.copy(),self.xy[:2]])
+
+
+    def _draw_samples(self,start,end):
+        """
+        Draw the plot of visible samples start to end-1, oldest first
+        """
+        x = self.plot_width - 1 - self.step * np.arange(self.capacity)[::-1]
+        y = self._to_pixels(self.values)
+
+        # Draw each run of samples without gaps as one line
+        finite = np.isfinite(y)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0],finite.astype(int),[0]))))
+        for run_start,run_end in zip(edges[::2],edges[1::2]):
+            # Part of run inside start:end, keeping a whole segment
+            # where the run has one
+            i0 = max(run_start,start)
+            i1 = min(run_end,end)
+            if i0 >= i1:
+                continue
+            if i1 - i0 == 1 and run_end - run_start > 1:
+                if i0 > run_start:
+                    i0 -= 1
+                else:
+                    i1 += 1
+
+            points = list(zip(x[i0:i1].tolist(),y[i0:i1].astype(int).tolist()))
+            if len(points) == 1:
+                points = points * 2
+            self._draw.line(points,fill=self.fill,width=self.line_width)
+
+
+    def _scroll(self):
+        """
+        Shift plot left by one step and draw the newest segment
+
+        The plot is the same as after redraw(): at both ends, columns
+        that may hold pixels of the wrong segments are cleared and the
+        segments crossing them drawn again.
+        """
+        w = self.plot_width
+        h = self.plot_height
+        s = self.step
+        self.image.paste(self.image.crop((s,0,w,h)),(0,0))
+
+        # Wide lines reach this far either side of their end points
+        pad = self.line_width
+
+        # Right end: columns shifted in from outside the plot, plus the
+        # pad around the previous newest sample, which may have been
+        # drawn as a single point
+        self._draw.rectangle((w - s - pad,0,w,h),fill=255,outline=255)
+
+        # Left end: up to the oldest sample, plus the pad, can hold the
+        # end of a segment that has left the buffer
+        x_oldest = w - 1 - s * (self.capacity - 1)
+        self._draw.rectangle((0,0,x_oldest + pad,h),fill=255,outline=255)
+
+        if self.y_range is None:
+            return
+
+        # Samples whose segments cross the cleared columns
+        n_left = 2 * pad // s + 2
+        n_right = (s - 1 + 2 * pad) // s + 2
+        self._draw_samples(0,min(n_left,self.capacity))
+        self._draw_samples(max(self.capacity - n_right,0),self.capacity)
+
+
+    def _fit_range(self):
+        """
+        Return y axis range for the current samples
+        """
+        if self.fixed_range is not None:
+            return self.fixed_range
+
+        values = self.samples[np.isfinite(self.samples)]
+        if len(values) == 0:
+            return self.y_range
+
+        lo = float(values.min())
+        hi = float(values.max())
+
+        # Keep current range while samples fit and fill enough of it
+        if self.y_range is not None:
+            cur_lo,cur_hi = self.y_range
+            if (lo >= cur_lo and hi <= cur_hi
+                and (hi - lo) >= self.shrink_ratio * (cur_hi - cur_lo)):
+                return self.y_range
+
+        pad = (hi - lo) * self.margin
+        if pad == 0:
+            pad = abs(hi) * self.margin or 1.0
+
+        return (lo - pad,hi + pad)
+
+
+    def _to_pixels(self,values):
+        """
+        Convert sample values to y pixel in plot, NaN stays NaN
+        """
+        lo,hi = self.y_range
+        values = np.clip(values,lo,hi)
+        return np.round((hi - values) / (hi - lo) * (self.plot_height - 1))
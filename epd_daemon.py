@@ -0,0 +1,713 @@
+"""
+Display daemon for Waveshare e-paper screen
+==============================================
+
+One long running process owns the initialised EPD object and the
+SPI device. Other processes send it frames over a Unix domain socket
+with EPDClient, which only costs a socket write rather than a full
+driver start up.
+
+Start the daemon on the R-Pi
+
+    python epd_daemon.py --socket /run/epd.sock --state-file /run/epd_state.json
+
+Example usage
+================
+
+Connect to daemon
+>>> client = EPDClient('/run/epd.sock')
+
+Send a packed frame for a region of the screen
+>>> client.send_frame(frame,region=(0,0,127,31))
+
+Send shapes to be drawn by the daemon
+>>> scene = Scene()
+>>> scene.rect((10,10,40,40),fill=0)
+>>> scene.text((10,100),'Hello',fontsize=20)
+>>> client.send_scene(scene.shapes)
+
+Wait for the frame to be on the screen
+>>> client.send_scene(scene.shapes,wait=True)
+
+
+Protocol
+=========
+Each message is
+
+    header length (4 bytes, big endian)
+    payload length (4 bytes, big endian)
+    header (JSON)
+    payload (bytes)
+
+Header keys
+
+    type   : 'frame' (payload is packed frame for region)
+             'scene' (header 'shapes' has a list of [shape,args,kwargs])
+    region : [x_start,y_start,x_end,y_end] or null for the whole screen,
+             x_start must be a multiple of 8 and x_end one less than
+             a multiple of 8
+    ack    : true to get a reply once the frame is on the screen, an
+             'ack' message or an 'error' message with a 'message' key.
+             Nothing is sent back for messages without ack.
+
+Frames and scenes from the same client for the same region that arrive
+before the next refresh replace each other, so only the latest is drawn.
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# ===================================
+# Imports
+# ===================================
+import os
+import json
+import time
+import struct
+import socket
+import threading
+import socketserver
+from collections import OrderedDict
+
+# waveshare_epd_lib and screen_lib are only needed by the daemon,
+# clients import them when they first need them
+
+# ===================================
+# Setup
+# ===================================
+
+DEFAULT_SOCKET = '/run/epd.sock'
+
+# Message framing: header length, payload length
+MESSAGE_PREFIX = struct.Struct('>II')
+MAX_HEADER_SIZE = 1024 * 1024
+
+# Shapes that can be sent in a scene, names of Screen methods
+SCENE_SHAPES = ('rect','line','ellipse','polygon','text')
+
+
+
+# ===================================
+# Protocol functions
+# ===================================
+
+def send_message(sock,header,payload=b''):
+    """
+    Send one message
+
+    Inputs
+    -------
+    sock : socket object
+    header : dict
+        JSON serialisable header
+    payload : bytes
+    """
+    head = json.dumps(header).encode('utf-8')
+    sock.sendall(MESSAGE_PREFIX.pack(len(head),len(payload)) + head + payload)
+
+
+def recv_message(rfile,max_payload):
+    """
+    Read one message
+
+    Inputs
+    -------
+    rfile : file object
+        file opened on the socket in binary mode
+
+    max_payload : int
+        largest payload accepted
+
+    Output
+    --------
+    header : dict or None
+        None if the connection has been closed
+    payload : bytes
+    """
+    prefix = rfile.read(MESSAGE_PREFIX.size)
+    if len(prefix) < MESSAGE_PREFIX.size:
+        return None,b''
+
+    head_len,payload_len = MESSAGE_PREFIX.unpack(prefix)
+    if head_len > MAX_HEADER_SIZE or payload_len > max_payload:
+        raise ValueError('Message too large')
+
+    head = rfile.read(head_len)
+    payload = rfile.read(payload_len)
+    if len(head) < head_len or len(payload) < payload_len:
+        return None,b''
+
+    return json.loads(head.decode('utf-8')),payload
+
+
+def check_region(region,width,height):
+    """
+    Check a region is inside the screen and byte aligned
+
+    Inputs
+    -------
+    region : list or None
+        [x_start,y_start,x_end,y_end] in pixels, None for whole screen
+
+    width : int
+    height : int
+        dimensions of screen in pixels
+
+    Output
+    --------
+    region : tuple
+        (x_start,y_start,x_end,y_end)
+    """
+    if region is None:
+        return (0,0,width-1,height-1)
+
+    x_start,y_start,x_end,y_end = [int(v) for v in region]
+    if x_start % 8 != 0 or x_end % 8 != 7:
+        raise ValueError('Region x coordinates must be aligned to bytes: %s' % (region,))
+    if not (0 <= x_start <= x_end < width and 0 <= y_start <= y_end < height):
+        raise ValueError('Region outside screen: %s' % (region,))
+
+    return (x_start,y_start,x_end,y_end)
+
+
+def socket_in_use(socket_path):
+    """
+    Check if a daemon is listening on a socket
+
+    Inputs
+    -------
+    socket_path : str
+        Unix domain socket
+
+    Output
+    --------
+    in_use : bool
+        True if something accepted a connection on the socket
+    """
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (IOError,OSError):
+        # No socket file, or a stale one left by a daemon that died
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+# ===================================
+# Daemon
+# ===================================
+
+class EPDDaemon():
+    """
+    Daemon that owns an EPD object and draws frames sent by clients
+
+    Example usage
+    -------------
+
+    >>> epd = EPD(state_file='/run/epd_state.json')
+    >>> daemon = EPDDaemon(epd,'/run/epd.sock')
+    >>> daemon.serve_forever()
+
+    """
+
+    def __init__(self,epd,socket_path=DEFAULT_SOCKET,
+                 min_interval=0.5,full_refresh_every=None):
+        """
+        Initialise daemon
+
+        Inputs
+        -------
+        epd : EPD object
+            initialised display
+
+        socket_path : str
+            Unix domain socket to listen on
+
+        min_interval : float
+            shortest time between screen refreshes in seconds. Frames
+            arriving in this time are combined into one refresh.
+
+        full_refresh_every : int or None
+            Do a full (flashing) refresh after this many partial
+            refreshes to clear ghosting. [Default None (never)]
+        """
+        self.epd = epd
+        self.socket_path = socket_path
+        self.min_interval = min_interval
+        self.full_refresh_every = full_refresh_every
+
+        self.width = epd.width
+        self.height = epd.height
+        self.frame_size = self.width * self.height // 8
+
+        # Frame composed from all clients, start from what is on screen
+        on_screen = epd.frame_banks[epd.active_bank]
+        if on_screen is None:
+            on_screen = b'\xff' * self.frame_size
+        self.frame = bytearray(on_screen)
+
+        # Pending frames from clients
+        # keys are (client_id,region), values are dicts with keys
+        # 'header','payload','acks'
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._running = False
+        self._last_refresh = 0.0
+        self._partial_count = 0
+        self._client_counter = 0
+
+        self.stats = {'messages':0,'coalesced':0,'refreshes':0,
+                      'full_refreshes':0,'errors':0}
+
+        self._server = None
+        self._panel_thread = None
+
+
+    def serve_forever(self):
+        """
+        Listen for clients and refresh the screen until shutdown()
+
+        Raises IOError if another daemon is listening on the socket.
+        """
+        if os.path.exists(self.socket_path):
+            if socket_in_use(self.socket_path):
+                raise IOError('Display daemon already running on %s' % self.socket_path)
+            # Left behind by a daemon that did not shut down
+            os.remove(self.socket_path)
+
+        self._server = _DaemonServer(self.socket_path,_ClientHandler)
+        self._server.epd_daemon = self
+        self._running = True
+
+        self._panel_thread = threading.Thread(target=self._panel_loop)
+        self._panel_thread.daemon = True
+        self._panel_thread.start()
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+    def shutdown(self):
+        """
+        Stop the daemon
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if self._server is not None:
+            self._server.shutdown()
+
+
+    def new_client_id(self):
+        """
+        Return an ID for a newly connected client
+        """
+        with self._cond:
+            self._client_counter += 1
+            return self._client_counter
+
+
+    def count_error(self):
+        """
+        Add one to stats['errors'], from any thread
+        """
+        with self._cond:
+            self.stats['errors'] += 1
+
+
+    def submit(self,client_id,header,payload,conn):
+        """
+        Queue a frame or scene for the next refresh
+
+        Inputs
+        -------
+        client_id : int
+        header : dict
+            message header
+        payload : bytes
+            packed frame for 'frame' messages
+        conn : socket object
+            client connection, used for acks
+        """
+        import waveshare_epd_lib as epd_lib
+
+        region = check_region(header.get('region'),self.width,self.height)
+        if header['type'] == 'frame':
+            size = len(epd_lib.frame_window_bytes(self.frame,region,self.width))
+            if len(payload) != size:
+                raise ValueError('Frame is %i bytes, region needs %i'
+                                 % (len(payload),size))
+        elif header['type'] == 'scene':
+            for shape in header['shapes']:
+                if shape[0] not in SCENE_SHAPES:
+                    raise ValueError('Unknown shape %s' % shape[0])
+        else:
+            raise ValueError('Unknown message type %s' % header['type'])
+
+        key = (client_id,region)
+        with self._cond:
+            self.stats['messages'] += 1
+            acks = []
+            if key in self._pending:
+                # Coalesce with frame not yet drawn
+                acks = self._pending.pop(key)['acks']
+                self.stats['coalesced'] += 1
+            if header.get('ack'):
+                acks.append(conn)
+            self._pending[key] = {'header':header,'payload':payload,'acks':acks}
+            self._cond.notify()
+
+
+    def _panel_loop(self):
+        """
+        Refresh screen with pending frames, runs in its own thread
+        """
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+
+            # Give other frames time to arrive, they are all drawn
+            # in the same refresh
+            delay = self._last_refresh + self.min_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            with self._cond:
+                pending = self._pending
+                self._pending = OrderedDict()
+
+            self._refresh(pending)
+
+
+    def _refresh(self,pending):
+        """
+        Draw pending frames into composed frame and update screen
+        """
+        import waveshare_epd_lib as epd_lib
+
+        acks = []
+        for (client_id,region),item in pending.items():
+            try:
+                if item['header']['type'] == 'scene':
+                    data = self._render_scene(item['header']['shapes'],region)
+                else:
+                    data = item['payload']
+                epd_lib.set_frame_window_bytes(self.frame,region,data,self.width)
+                acks.extend((conn,{'type':'ack'}) for conn in item['acks'])
+            except Exception as err:
+                self.count_error()
+                acks.extend((conn,{'type':'error','message':str(err)})
+                            for conn in item['acks'])
+
+        frame = bytes(self.frame)
+        try:
+            self._update_panel(frame)
+        except Exception as err:
+            # Keep the panel thread running, e.g. after an SPI error,
+            # and tell the clients waiting for this refresh
+            self.count_error()
+            acks = [(conn,{'type':'error','message':'Screen update failed: %s' % err})
+                    for conn,reply in acks]
+        self._last_refresh = time.time()
+
+        for conn,header in acks:
+            try:
+                send_message(conn,header)
+            except (IOError,OSError):
+                # client has gone away
+                pass
+
+
+    def _update_panel(self,frame):
+        """
+        Show the composed frame, with a full refresh when one is due
+        """
+        if (self.full_refresh_every is not None
+            and self._partial_count >= self.full_refresh_every):
+            # Full refresh, write both banks like EPD.clear_screen()
+            self.epd.set_to_full_update()
+            self.epd.update_frame(frame,force=True)
+            self.epd.update_frame(frame,force=True)
+            self.epd.set_to_partial_update()
+            self._partial_count = 0
+            self.stats['full_refreshes'] += 1
+        else:
+            self.epd.update_frame(frame)
+            self._partial_count += 1
+        self.stats['refreshes'] += 1
+
+
+    def _render_scene(self,shapes,region):
+        """
+        Render a list of shapes and return the packed bytes of region
+        """
+        import screen_lib as scr
+        import waveshare_epd_lib as epd_lib
+
+        screen = scr.Screen(self.width,self.height)
+        for shape,args,kwargs in shapes:
+            kwargs.pop('font',None)
+            getattr(screen,shape)(*args,**kwargs)
+
+        x_start,y_start,x_end,y_end = region
+        image = screen.image.crop((x_start,y_start,x_end + 1,y_end + 1))
+        return epd_lib.pack_image(image)
+
+
+
+class _DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _ClientHandler(socketserver.StreamRequestHandler):
+    """
+    Read messages from one client connection
+    """
+
+    def handle(self):
+        daemon = self.server.epd_daemon
+        client_id = daemon.new_client_id()
+        while True:
+            try:
+                header,payload = recv_message(self.rfile,daemon.frame_size)
+            except ValueError:
+                # Message too large or header not JSON, the rest of the
+                # stream cannot be read, so drop the connection
+                daemon.count_error()
+                return
+            if header is None:
+                return
+
+            try:
+                daemon.submit(client_id,header,payload,self.request)
+            except (ValueError,KeyError,TypeError,IndexError,AttributeError) as err:
+                daemon.count_error()
+                # Only reply when the client is waiting for one,
+                # otherwise the reply would be read as the answer to
+                # a later message
+                if not (isinstance(header,dict) and header.get('ack')):
+                    continue
+                try:
+                    send_message(self.request,{'type':'error','message':str(err)})
+                except (IOError,OSError):
+                    return
+
+
+
+# ===================================
+# Client
+# ===================================
+
+class EPDClient():
+    """
+    Client for sending frames to the display daemon
+
+    Example usage
+    -------------
+
+    >>> client = EPDClient('/run/epd.sock')
+    >>> client.send_frame(frame)
+
+    """
+
+    def __init__(self,socket_path=DEFAULT_SOCKET):
+        """
+        Connect to daemon
+
+        Inputs
+        -------
+        socket_path : str
+            Unix domain socket the daemon is listening on
+        """
+        self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self._rfile = self.sock.makefile('rb')
+
+
+    def send_frame(self,frame,region=None,wait=False):
+        """
+        Send a packed frame
+
+        Inputs
+        -------
+        frame : bytes
+            packed frame for region, see waveshare_epd_lib.pack_image()
+
+        region : tuple
+            (x_start,y_start,x_end,y_end) in pixels. x_start must be a
+            multiple of 8 and x_end one less than a multiple of 8.
+            [Default None (whole screen)]
+
+        wait : bool
+            wait until frame is on the screen
+        """
+        header = {'type':'frame','region':region,'ack':wait}
+        send_message(self.sock,header,bytes(frame))
+        if wait:
+            self._wait_for_ack()
+
+
+    def send_image(self,image,region=None,wait=False):
+        """
+        Send a PIL image, the whole screen or cropped to a region
+
+        Inputs
+        -------
+        image : PIL image object
+            image the same size as the screen
+
+        region : tuple
+            see send_frame()
+
+        wait : bool
+            wait until frame is on the screen
+        """
+        import waveshare_epd_lib as epd_lib
+
+        if region is not None:
+            x_start,y_start,x_end,y_end = region
+            image = image.crop((x_start,y_start,x_end + 1,y_end + 1))
+
+        self.send_frame(epd_lib.pack_image(image),region,wait)
+
+
+    def send_scene(self,shapes,region=None,wait=False):
+        """
+        Send shapes for the daemon to draw
+
+        Inputs
+        -------
+        shapes : list
+            list of [shape,args,kwargs], where shape is the name of a
+            Screen method, see Scene()
+
+        region : tuple
+            see send_frame()
+
+        wait : bool
+            wait until frame is on the screen
+        """
+        header = {'type':'scene','region':region,'ack':wait,
+                  'shapes':[[shape,list(args),dict(kwargs)] for shape,args,kwargs in shapes]}
+        send_message(self.sock,header)
+        if wait:
+            self._wait_for_ack()
+
+
+    def close(self):
+        """
+        Disconnect from daemon
+        """
+        self._rfile.close()
+        self.sock.close()
+
+
+    def _wait_for_ack(self):
+        """
+        Wait for daemon to acknowledge the last message
+        """
+        header,payload = recv_message(self._rfile,0)
+        if header is None:
+            raise IOError('Connection to display daemon closed')
+        if header['type'] == 'error':
+            raise ValueError(header['message'])
+
+
+
+class Scene():
+    """
+    Records shapes to send to the daemon with EPDClient.send_scene()
+
+    Has the same shape methods as Screen: rect(), line(), ellipse(),
+    polygon() and text().
+
+    Example usage
+    -------------
+
+    >>> scene = Scene()
+    >>> scene.rect((10,10,40,40),fill=0)
+    >>> scene.text((10,100),'Hello',fontsize=20)
+    >>> client.send_scene(scene.shapes)
+
+    """
+
+    def __init__(self):
+        self.shapes = []
+
+    def __getattr__(self,name):
+        if name not in SCENE_SHAPES:
+            raise AttributeError(name)
+
+        def add_shape(*args,**kwargs):
+            self.shapes.append([name,list(args),kwargs])
+
+        return add_shape
+
+
+
+# ===================================
+# Main
+# ===================================
+
+def main():
+    """
+    Run the daemon from the command line
+    """
+    import argparse
+    from waveshare_epd_lib import EPD
+
+    parser = argparse.ArgumentParser(description='e-paper display daemon')
+    parser.add_argument('--socket',default=DEFAULT_SOCKET,
+                        help='Unix domain socket to listen on')
+    parser.add_argument('--state-file',default=None,
+                        help='state file for EPD()')
+    parser.add_argument('--min-interval',type=float,default=0.5,
+                        help='shortest time between refreshes in seconds')
+    parser.add_argument('--full-refresh-every',type=int,default=None,
+                        help='full refresh after this many partial refreshes')
+    parser.add_argument('--spi-dev',type=int,default=1,
+                        help='SPI device, 0 or 1')
+    args = parser.parse_args()
+
+    # Check before EPD() initialises the screen under a running daemon
+    if socket_in_use(args.socket):
+        parser.error('display daemon already running on %s' % args.socket)
+
+    epd = EPD(spi_dev=args.spi_dev,state_file=args.state_file)
+    if not epd.warm_start:
+        epd.clear_screen()
+
+    daemon = EPDDaemon(epd,args.socket,min_interval=args.min_interval,
+                       full_refresh_every=args.full_refresh_every)
+    daemon.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,503 @@
+"""
+Compact frame format for e-paper screens
+=============================================
+
+Encodes a sequence of packed frames (see waveshare_epd_lib.pack_image())
+as keyframes and deltas, for sending frames over slow links or keeping
+them on disk.
+
+* Keyframe : whole frame, run length encoded
+* Delta    : XOR of the changed window against the previous frame,
+             run length encoded
+* Repeat   : frame is the same as the previous frame
+
+Windows are stored as whole bytes in x and rows in y, the same as
+EPD.set_memory_area(), so a delta can be sent to the screen without
+making an image.
+
+Example usage
+================
+
+Encode frames
+>>> encoder = FrameEncoder()
+>>> data = b''.join(encoder.encode(frame) for frame in frames)
+
+Decode frames
+>>> decoder = FrameDecoder()
+>>> frames = [decoder.decode(record) for record in iter_records(data)]
+
+Show frames on screen
+>>> epd.apply_frame_records(data)
+
+
+Record format
+===============
+
+Each record is a header followed by the payload
+
+    magic        2 bytes  b'EF'
+    version      1 byte
+    kind         1 byte   0=keyframe, 1=delta, 2=repeat
+    width        2 bytes  pixels
+    height       2 bytes  pixels
+    xb_start     1 byte   first byte column of window
+    xb_end       1 byte   last byte column of window
+    y_start      2 bytes  first row of window
+    y_end        2 bytes  last row of window
+    ref_crc      4 bytes  CRC32 of the frame a delta applies to
+    payload_len  4 bytes
+
+All numbers are big endian. The payload is PackBits run length encoded.
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+# ===================================
+# Imports
+# ===================================
+import io
+import re
+import struct
+import zlib
+
+from waveshare_epd_lib import (EPD_WIDTH,EPD_HEIGHT,frame_window,
+                               frame_window_bytes,set_frame_window_bytes)
+
+# ===================================
+# Setup
+# ===================================
+
+MAGIC = b'EF'
+VERSION = 1
+
+KEYFRAME = 0
+DELTA = 1
+REPEAT = 2
+
+HEADER = struct.Struct('>2sBBHHBBHHII')
+
+# Runs of 3 or more of the same byte are worth encoding as a run
+_RUN = re.compile(b'(.)\\1{2,}',re.S)
+
+
+
+# ===================================
+# Run length encoding
+# ===================================
+
+def packbits_encode(data):
+    """
+    PackBits run length encode bytes
+
+    Inputs
+    -------
+    data : bytes
+
+    Output
+    --------
+    encoded : bytes
+        control byte n followed by n+1 literal bytes for n in 0..127,
+        or control byte 257-n followed by one byte repeated n times
+        for n in 2..128
+    """
+    out = bytearray()
+    pos = 0
+    for match in _RUN.finditer(data):
+        _add_literal(out,data,pos,match.start())
+        value = data[match.start()]
+        count = match.end() - match.start()
+        while count >= 2:
+            n = min(count,128)
+            out.append(257 - n)
+            out.append(value)
+            count -= n
+        if count == 1:
+            _add_literal(out,data,match.end() - 1,match.end())
+        pos = match.end()
+
+    _add_literal(out,data,pos,len(data))
+    return bytes(out)
+
+
+def _add_literal(out,data,start,end):
+    """
+    Add data[start:end] as literal blocks of up to 128 bytes
+    """
+    while start < end:
+        n = min(end - start,128)
+        out.append(n - 1)
+        out += data[start:start + n]
+        start += n
+
+
+def packbits_decode(encoded,size=None):
+    """
+    Decode PackBits run length encoded bytes
+
+    Inputs
+    -------
+    encoded : bytes
+
+    size : int
+        expected number of decoded bytes [Default None (don't check)]
+
+    Output
+    --------
+    data : bytes
+    """
+    out = bytearray()
+    pos = 0
+    n_encoded = len(encoded)
+    while pos < n_encoded:
+        n = encoded[pos]
+        if n < 128:
+            out += encoded[pos + 1:pos + n + 2]
+            pos += n + 2
+        elif n > 128:
+            out += encoded[pos + 1:pos + 2] * (257 - n)
+            pos += 2
+        else:
+            pos += 1
+
+    if size is not None and len(out) != size:
+        raise ValueError('Decoded %i bytes, expected %i' % (len(out),size))
+
+    return bytes(out)
+
+
+def xor_bytes(a,b):
+    """
+    XOR two byte strings of the same length
+    """
+    n = len(a)
+    if len(b) != n:
+        raise ValueError('Cannot XOR %i bytes with %i bytes' % (n,len(b)))
+    return (int.from_bytes(a,'big') ^ int.from_bytes(b,'big')).to_bytes(n,'big')
+
+
+def frame_crc(frame):
+    """
+    CRC32 of a frame, used to check a delta is applied to the right frame
+    """
+    return zlib.crc32(frame) & 0xFFFFFFFF
+
+
+
+# ===================================
+# Records
+# ===================================
+
+class FrameRecord():
+    """
+    One encoded frame
+    """
+
+    def __init__(self,kind,width,height,window,ref_crc=0,payload=b''):
+        """
+        Inputs
+        -------
+        kind : int
+            KEYFRAME, DELTA or REPEAT
+
+        width : int
+        height : int
+            dimensions of frame in pixels
+
+        window : tuple
+            (xb_start,xb_end,y_start,y_end), x in bytes and y in rows
+
+        ref_crc : int
+            CRC32 of frame a delta applies to
+
+        payload : bytes
+            run length encoded data
+        """
+        self.kind = kind
+        self.width = width
+        self.height = height
+        self.window = window
+        self.ref_crc = ref_crc
+        self.payload = payload
+
+    def __repr__(self):
+        return 'FrameRecord(%s,%s,%i bytes)' % ({KEYFRAME:'keyframe',DELTA:'delta',
+                                                 REPEAT:'repeat'}[self.kind],
+                                                self.window,len(self.payload))
+
+    @property
+    def pixel_window(self):
+        """
+        Window in pixels (x_start,y_start,x_end,y_end), as used by
+        EPD.set_memory_area()
+        """
+        xb_start,xb_end,y_start,y_end = self.window
+        return (xb_start*8,y_start,xb_end*8 + 7,y_end)
+
+    @property
+    def window_size(self):
+        """
+        Number of bytes in window
+        """
+        xb_start,xb_end,y_start,y_end = self.window
+        return (xb_end - xb_start + 1) * (y_end - y_start + 1)
+
+    def validate(self):
+        """
+        Check the kind and window of the record
+
+        Raises ValueError if the kind is unknown or the window is not
+        inside the frame.
+        """
+        if self.kind not in (KEYFRAME,DELTA,REPEAT):
+            raise ValueError('Unknown frame record kind %r' % (self.kind,))
+
+        if self.kind == DELTA:
+            xb_start,xb_end,y_start,y_end = self.window
+            if not (0 <= xb_start <= xb_end < self.width // 8
+                    and 0 <= y_start <= y_end < self.height):
+                raise ValueError('Frame record window %s outside %ix%i frame'
+                                 % (self.window,self.width,self.height))
+
+    def to_bytes(self):
+        """
+        Return record as bytes
+        """
+        xb_start,xb_end,y_start,y_end = self.window
+        return HEADER.pack(MAGIC,VERSION,self.kind,self.width,self.height,
+                           xb_start,xb_end,y_start,y_end,
+                           self.ref_crc,len(self.payload)) + self.payload
+
+
+def read_record(f):
+    """
+    Read one record from a file
+
+    Inputs
+    -------
+    f : file object
+        opened in binary mode
+
+    Output
+    --------
+    record : FrameRecord or None
+        None at end of file
+    """
+    header = f.read(HEADER.size)
+    if len(header) == 0:
+        return None
+    if len(header) < HEADER.size:
+        raise ValueError('Truncated frame record header')
+
+    (magic,version,kind,width,height,xb_start,xb_end,
+     y_start,y_end,ref_crc,payload_len) = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a frame record')
+
+    payload = f.read(payload_len)
+    if len(payload) < payload_len:
+        raise ValueError('Truncated frame record payload')
+
+    return FrameRecord(kind,width,height,(xb_start,xb_end,y_start,y_end),
+                       ref_crc,payload)
+
+
+def iter_records(stream):
+    """
+    Iterate over records in a stream
+
+    Inputs
+    -------
+    stream : bytes or file object
+        encoded frames
+
+    Output
+    --------
+    records : iterator of FrameRecord
+    """
+    if isinstance(stream,(bytes,bytearray)):
+        stream = io.BytesIO(stream)
+
+    while True:
+        record = read_record(stream)
+        if record is None:
+            return
+        yield record
+
+
+
+# ===================================
+# Encoder / decoder
+# ===================================
+
+class FrameEncoder():
+    """
+    Encode a sequence of frames as keyframes and deltas
+
+    Example usage
+    -------------
+
+    >>> encoder = FrameEncoder(keyframe_interval=60)
+    >>> with open('frames.epf','ab') as f:
+    ...     f.write(encoder.encode(frame))
+
+    """
+
+    def __init__(self,width=EPD_WIDTH,height=EPD_HEIGHT,keyframe_interval=None):
+        """
+        Inputs
+        -------
+        width : int
+        height : int
+            dimensions of frames in pixels
+
+        keyframe_interval : int or None
+            send a keyframe every this many frames, so a receiver
+            can join part way through [Default None (only the first)]
+        """
+        self.width = width
+        self.height = height
+        self.frame_size = width * height // 8
+        self.keyframe_interval = keyframe_interval
+        self.reference = None
+        self._count = 0
+
+    def reset(self):
+        """
+        Make the next frame a keyframe
+        """
+        self.reference = None
+
+    def encode(self,frame):
+        """
+        Encode next frame
+
+        Inputs
+        -------
+        frame : bytes
+            packed frame
+
+        Output
+        --------
+        data : bytes
+            encoded record
+        """
+        return self.encode_record(frame).to_bytes()
+
+    def encode_record(self,frame):
+        """
+        Encode next frame, returning a FrameRecord
+        """
+        frame = bytes(frame)
+        if len(frame) != self.frame_size:
+            raise ValueError('Frame is %i bytes, expected %i' % (len(frame),self.frame_size))
+
+        if (self.reference is None
+            or (self.keyframe_interval is not None
+                and self._count % self.keyframe_interval == 0)):
+            record = FrameRecord(KEYFRAME,self.width,self.height,
+                                 (0,self.width // 8 - 1,0,self.height - 1),
+                                 0,packbits_encode(frame))
+        else:
+            record = self._delta(frame)
+
+        self.reference = frame
+        self._count += 1
+        return record
+
+    def _delta(self,frame):
+        """
+        Delta record against self.reference
+        """
+        ref_crc = frame_crc(self.reference)
+        window = frame_window(self.reference,frame,self.width,self.height)
+        if window is None:
+            return FrameRecord(REPEAT,self.width,self.height,(0,0,0,0),ref_crc)
+
+        x_start,y_start,x_end,y_end = window
+        delta = xor_bytes(frame_window_bytes(self.reference,window,self.width),
+                          frame_window_bytes(frame,window,self.width))
+
+        return FrameRecord(DELTA,self.width,self.height,
+                           (x_start >> 3,x_end >> 3,y_start,y_end),
+                           ref_crc,packbits_encode(delta))
+
+
+
+class FrameDecoder():
+    """
+    Decode records made by FrameEncoder back into frames
+    """
+
+    def __init__(self,width=EPD_WIDTH,height=EPD_HEIGHT,reference=None):
+        """
+        Inputs
+        -------
+        width : int
+        height : int
+            dimensions of frames in pixels
+
+        reference : bytes
+            frame the first delta applies to, if the stream does not
+            start with a keyframe [Default None]
+        """
+        self.width = width
+        self.height = height
+        self.frame_size = width * height // 8
+        self.reference = None if reference is None else bytes(reference)
+
+    def decode(self,record):
+        """
+        Decode next record
+
+        Inputs
+        -------
+        record : FrameRecord or bytes
+
+        Output
+        --------
+        frame : bytes
+            packed frame
+        """
+        if not isinstance(record,FrameRecord):
+            record = read_record(io.BytesIO(record))
+
+        if record.width != self.width or record.height != self.height:
+            raise ValueError('Record is for %ix%i frames' % (record.width,record.height))
+        record.validate()
+
+        if record.kind == KEYFRAME:
+            self.reference = packbits_decode(record.payload,self.frame_size)
+            return self.reference
+
+        if self.reference is None or frame_crc(self.reference) != record.ref_crc:
+            raise ValueError('Delta does not match reference frame')
+
+        if record.kind == REPEAT:
+            return self.reference
+
+        window = record.pixel_window
+        delta = packbits_decode(record.payload,record.window_size)
+        data = xor_bytes(frame_window_bytes(self.reference,window,self.width),delta)
+
+        frame = bytearray(self.reference)
+        set_frame_window_bytes(frame,window,data,self.width)
+        self.reference = bytes(frame)
+        return self.reference
@@ -0,0 +1,241 @@
+"""
+Look up tables (waveforms) for Waveshare 2.13" e-paper screen
+================================================================
+
+The LUT sets the voltages applied to the pixels and for how long, which
+sets both the quality and the time taken by a refresh. This module has
+named presets that trade quality for speed, plus variants for cold
+screens, which need longer phases.
+
+LUT layout (30 bytes), as used by the Waveshare tables
+
+    bytes 0-15  : voltage selection data, the voltages applied to pixels
+                  going black or white during the phases
+    bytes 16-25 : length of phases 0-9, in frames
+    bytes 26-29 : unused
+
+validate_lut() checks this layout: a LUT must select a voltage
+somewhere in bytes 0-15 and give at least one phase a length.
+
+Example usage
+================
+
+Update with a fast LUT
+>>> epd.update(lut='partial_fast')
+
+Pick the LUT for the temperature
+>>> epd.set_temperature(5)
+>>> epd.update(lut='partial')    # uses 'partial_cold'
+
+Refresh times measured for each LUT
+>>> epd.lut_stats['partial_fast']
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+from collections import OrderedDict
+
+# ===================================
+# Setup
+# ===================================
+
+LUT_LENGTH = 30
+N_VOLTAGE_BYTES = 16
+N_PHASES = 10
+PHASE_LENGTH_START = 16
+
+# Below this temperature (deg C) the '_cold' variant of a LUT is used
+COLD_TEMPERATURE = 10
+
+# Full update - flickers
+LUT_FULL_UPDATE = [
+    0x22, 0x55, 0xAA, 0x55, 0xAA, 0x55, 0xAA, 0x11,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x1E, 0x1E, 0x1E, 0x1E, 0x1E, 0x1E, 0x1E, 0x1E,
+    0x01, 0x00, 0x00, 0x00, 0x00, 0x00
+]
+
+# Partial update - smoother
+LUT_PARTIAL_UPDATE  = [
+    0x18, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x0F, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00
+]
+
+
+
+# ===================================
+# Functions
+# ===================================
+
+def validate_lut(lut):
+    """
+    Check a LUT is well formed
+
+    Inputs
+    -------
+    lut : list of int
+
+    Output
+    --------
+    lut : list of int
+        copy of lut
+
+    Raises ValueError if the LUT is not 30 bytes, selects no voltage
+    in bytes 0-15 or has no phase with a length in bytes 16-25.
+    """
+    lut = list(lut)
+    if len(lut) != LUT_LENGTH:
+        raise ValueError('LUT must be %i bytes, not %i' % (LUT_LENGTH,len(lut)))
+
+    for value in lut:
+        if not isinstance(value,int) or not 0 <= value <= 0xFF:
+            raise ValueError('LUT values must be bytes, not %r' % (value,))
+
+    if not any(lut[:N_VOLTAGE_BYTES]):
+        raise ValueError('LUT selects no voltage in bytes 0-%i' % (N_VOLTAGE_BYTES - 1))
+
+    if lut_frames(lut) == 0:
+        raise ValueError('LUT has no phase with a length in bytes %i-%i'
+                         % (PHASE_LENGTH_START,PHASE_LENGTH_START + N_PHASES - 1))
+
+    return lut
+
+
+def scale_lut(lut,factor):
+    """
+    Return a LUT with all phase lengths scaled
+
+    Inputs
+    -------
+    lut : list of int
+
+    factor : float
+        scale for phase lengths, < 1 is faster. Phases that are used
+        keep a length of at least 1.
+
+    Output
+    --------
+    lut : list of int
+    """
+    lut = list(lut)
+    for i in range(PHASE_LENGTH_START,PHASE_LENGTH_START + N_PHASES):
+        if lut[i]:
+            lut[i] = min(0xFF,max(1,int(round(lut[i] * factor))))
+    return lut
+
+
+def lut_frames(lut):
+    """
+    Total length of all phases in frames, refresh time is roughly
+    proportional to this
+
+    Inputs
+    -------
+    lut : list of int
+
+    Output
+    --------
+    frames : int
+    """
+    return sum(lut[PHASE_LENGTH_START:PHASE_LENGTH_START + N_PHASES])
+
+
+def select_lut(name,temperature=None):
+    """
+    Return name of LUT to use at a temperature
+
+    Inputs
+    -------
+    name : str
+        name of preset
+
+    temperature : float or None
+        screen temperature in deg C [Default None (unknown)]
+
+    Output
+    --------
+    name : str
+        name of the '_cold' variant when it is cold and there is one,
+        otherwise name
+    """
+    if (temperature is not None and temperature < COLD_TEMPERATURE
+        and name + '_cold' in LUT_PRESETS):
+        return name + '_cold'
+    return name
+
+
+
+class LUT():
+    """
+    Named look up table
+    """
+
+    def __init__(self,name,data,mode,description=''):
+        """
+        Inputs
+        -------
+        name : str
+
+        data : list of int
+            30 byte LUT, checked with validate_lut()
+
+        mode : str
+            'full' or 'partial'
+
+        description : str
+        """
+        self.name = name
+        self.data = validate_lut(data)
+        self.mode = mode
+        self.description = description
+
+    def __repr__(self):
+        return 'LUT(%s, %i frames)' % (self.name,lut_frames(self.data))
+
+
+
+# ===================================
+# Presets
+# ===================================
+
+LUT_PRESETS = OrderedDict((lut.name,lut) for lut in [
+    LUT('full',LUT_FULL_UPDATE,'full',
+        'Manufacturer full update (241 frames), flashes and clears ghosting'),
+    LUT('full_cold',scale_lut(LUT_FULL_UPDATE,1.5),'full',
+        'Full update with phases 1.5 times longer (362 frames) for screens below 10C'),
+    LUT('full_fast',scale_lut(LUT_FULL_UPDATE,0.5),'full',
+        'Full update with half length phases (121 frames), expect some ghosting'),
+    LUT('partial',LUT_PARTIAL_UPDATE,'partial',
+        'Manufacturer partial update (16 frames)'),
+    LUT('partial_cold',scale_lut(LUT_PARTIAL_UPDATE,1.5),'partial',
+        'Partial update with phases 1.5 times longer (24 frames) for screens below 10C'),
+    LUT('partial_fast',[0x18] + [0x00]*15 + [0x08] + [0x00]*13,'partial',
+        'Single phase partial update (8 frames), expect lighter blacks'),
+    LUT('partial_minimal',[0x18] + [0x00]*15 + [0x04] + [0x00]*13,'partial',
+        'Shortest single phase partial update (4 frames) for rapidly changing '
+        'text, expect faint text that ghosts quickly'),
+])
+
+# Refresh time is roughly proportional to the frames in each LUT, the
+# busy time of each preset on a screen is measured by
+# python benchmarks.py lut
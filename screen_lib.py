@@ -27,20 +27,91 @@ black and white images for e-paper displays.
 #  
 #  
 
+import time
+import threading
 from collections import OrderedDict
 
 from PIL import Image,ImageDraw,ImageFont
 
 DEFAULT_TRUETYPE_FONT = 'FreeMono.ttf'
-try:
-    # Try to load a font available for Raspberry Pi
-    DEFAULT_FONT_SIZE = 16
-    DEFAULT_FONT = ImageFont.truetype(font=DEFAULT_TRUETYPE_FONT, size=DEFAULT_FONT_SIZE)
-    FONT_IS_RESIZABLE = True
-except:
-    # If all else fails, use the PIL default
-    DEFAULT_FONT = ImageFont.load_default()
-    FONT_IS_RESIZABLE = False
+DEFAULT_FONT_SIZE = 16
+
+# Fonts are loaded the first time they are used rather than at import,
+# loading a TrueType file is one of the slowest parts of starting up.
+# Cache is keyed on (font_filename,fontsize)
+_font_cache = {}
+_fallback_fonts = set()
+
+
+def get_font(fontsize=DEFAULT_FONT_SIZE,font_filename=DEFAULT_TRUETYPE_FONT):
+    """
+    Return a font, loading it on first use
+
+    Inputs
+    -----------
+    fontsize : int
+        size of font [default=DEFAULT_FONT_SIZE]
+
+    font_filename : str
+        TrueType font file [default=DEFAULT_TRUETYPE_FONT]
+
+    Output
+    --------
+    font : PIL font object
+        The requested font. If it cannot be loaded the default font
+        is returned instead, and if that cannot be loaded either
+        the PIL default font.
+    """
+    key = (font_filename,fontsize)
+    if key not in _font_cache:
+        try:
+            # Try to load a font available for Raspberry Pi
+            _font_cache[key] = ImageFont.truetype(font=font_filename, size=fontsize)
+        except:
+            default_key = (DEFAULT_TRUETYPE_FONT,DEFAULT_FONT_SIZE)
+            if key != default_key:
+                _font_cache[key] = get_font()
+            else:
+                # If all else fails, use the PIL default
+                _font_cache[key] = ImageFont.load_default()
+            _fallback_fonts.add(key)
+
+    return _font_cache[key]
+
+
+def text_size(font,text_str):
+    """
+    Return size of text in pixels
+
+    Inputs
+    -----------
+    font : PIL font object
+
+    text_str : str
+
+    Output
+    --------
+    size : tuple
+        (width,height)
+    """
+    if hasattr(font,'getbbox'):
+        left,top,right,bottom = font.getbbox(text_str)
+        return (right,bottom)
+
+    # Pillow < 8
+    return font.getsize(text_str)
+
+
+def __getattr__(name):
+    """
+    Load DEFAULT_FONT and FONT_IS_RESIZABLE when they are first accessed
+    """
+    if name == 'DEFAULT_FONT':
+        return get_font()
+    if name == 'FONT_IS_RESIZABLE':
+        get_font()
+        return (DEFAULT_TRUETYPE_FONT,DEFAULT_FONT_SIZE) not in _fallback_fonts
+    raise AttributeError("module %r has no attribute %r" % (__name__,name))
 
 
 class Screen():
@@ -61,6 +132,19 @@ class Screen():
     Return a PIL image object
     >>> my_image = scr.image
 
+    Change a shape from another thread
+    >>> scr.update_shape('rect0',args=[(20,20,50,50)])
+
+    Remove a shape
+    >>> scr.remove_shape('rect0')
+
+    Thread safety
+    --------------
+    Shapes can be added, changed and removed from any thread.
+    self.shapes is never changed in place, each change replaces it with
+    a new copy (copy on write), so rendering works from the copy it
+    started with and never blocks threads changing the shapes.
+
     """
 
     def __init__(self,width=128,height=250):
@@ -75,10 +159,23 @@ class Screen():
         self._draw = ImageDraw.Draw(self._image)
 
         # Shape list
-        # 
+        # Replaced, never changed in place, see _add_shape()
         self.shapes = OrderedDict()
         self.shape_counter = 0
 
+        # Counts changes to the shapes, see render()
+        self.shape_version = 0
+
+        # _shape_lock is held while changing self.shapes
+        # _render_lock is held while drawing into self._image
+        self._shape_lock = threading.Lock()
+        self._render_lock = threading.Lock()
+
+        self.stats = {'renders':0,
+                      'shape_changes':0,
+                      'shape_lock_contention':0,
+                      'shape_lock_wait_s':0.0}
+
     @property
     def image(self):
         """
@@ -87,13 +184,38 @@ class Screen():
         Output
         --------
         image : PIL image object
-            Image with all shapes rendered
+            Image with all shapes rendered, a copy that is not
+            changed by later renders
         """
-        self.blank_screen()
-        for name,shape in self.shapes.items():
-            shape.draw()
+        return self.render()[0]
 
-        return self._image
+    def render(self):
+        """
+        Render all the shapes
+
+        Output
+        --------
+        image : PIL image object
+            see image
+
+        version : int
+            shape_version of the shapes drawn. The image is the same
+            while shape_version has not changed.
+        """
+        with self._render_lock:
+            # self.shapes is replaced rather than changed by other
+            # threads, so this copy stays the same while drawing.
+            # Take it with its version, not part way through a change.
+            with self._shape_lock:
+                shapes = self.shapes
+                version = self.shape_version
+
+            self.blank_screen()
+            for name,shape in shapes.items():
+                shape.draw()
+
+            self.stats['renders'] += 1
+            return self._image.copy(),version
 
     def __getitem__(self,key):
         """
@@ -115,11 +237,121 @@ class Screen():
         Clear all shapes from memory
         """
 
-        self._image = Image.new('1', (self.width, self.height), 255)
-        self._draw = ImageDraw.Draw(self._image)
+        with self._locked_shapes():
+            self.shapes = OrderedDict()
+            self.shape_counter = 0
 
-        self.shapes = OrderedDict()
-        self.shape_counter = 0
+
+    def update_shape(self,name,args=None,kwargs=None):
+        """
+        Change the arguments of a shape
+
+        Safe to use while another thread is rendering, the change is
+        drawn on the next render.
+
+        Inputs
+        -----------
+        name : str
+            name of shape
+
+        args : list
+            new arguments, [default=None (keep existing)]
+
+        kwargs : dict
+            new keyword arguments, replace the existing ones
+            [default=None (keep existing)]
+        """
+        with self._locked_shapes():
+            assert name in self.shapes, "No shape called %s in screen" % name
+            shape = self.shapes[name]
+            if args is None:
+                args = shape.args
+            if kwargs is None:
+                kwargs = shape.kwargs
+
+            shapes = OrderedDict(self.shapes)
+            shapes[name] = Shape(name,shape.function,list(args),dict(kwargs),shape.params)
+            self.shapes = shapes
+
+
+    def remove_shape(self,name):
+        """
+        Remove a shape
+
+        Safe to use while another thread is rendering, use this rather
+        than changing self.shapes.
+
+        Inputs
+        -----------
+        name : str
+            name of shape
+        """
+        with self._locked_shapes():
+            assert name in self.shapes, "No shape called %s in screen" % name
+            shapes = OrderedDict(self.shapes)
+            del shapes[name]
+            self.shapes = shapes
+
+
+    def _add_shape(self,prefix,name,function,args,kwargs,params=None):
+        """
+        Add a shape, replacing self.shapes with a new copy
+
+        Inputs
+        -----------
+        prefix : str
+            start of the name made for the shape if name is None
+
+        name : str or None
+            name of shape
+
+        function : function
+            drawing function
+
+        args : list
+        kwargs : dict
+            arguments for function
+
+        params : dict
+            arguments of Screen method making the shape, see Shape
+            [default=None]
+
+        Output
+        --------
+        name : str
+            name of shape
+        """
+        with self._locked_shapes():
+            if name is None:
+                name = '%s%i' % (prefix,self.shape_counter)
+
+            shapes = OrderedDict(self.shapes)
+            shapes[name] = Shape(name,function,args,kwargs,params)
+            self.shapes = shapes
+            self.shape_counter +=1
+
+        return name
+
+
+    def _locked_shapes(self):
+        """
+        Acquire shape lock to change the shapes, recording contention
+        in self.stats and counting the change in self.shape_version
+
+        Output
+        --------
+        lock : threading.Lock
+            lock already acquired, use in a with statement to release
+        """
+        if not self._shape_lock.acquire(False):
+            t_start = time.time()
+            self._shape_lock.acquire()
+            self.stats['shape_lock_contention'] += 1
+            self.stats['shape_lock_wait_s'] += time.time() - t_start
+
+        self.stats['shape_changes'] += 1
+        self.shape_version += 1
+        return _AcquiredLock(self._shape_lock)
         
 
     def blank_screen(self):
@@ -153,14 +385,10 @@ class Screen():
             fill colour [default=255 (white)]
 
         """
-        if name is None:
-            name = 'rect%i' % self.shape_counter
-            
         args = [xy]
         kwargs = {'outline':outline,'fill':fill}
 
-        self.shapes[name] = Shape(name,self._draw.rectangle,args,kwargs)
-        self.shape_counter +=1
+        self._add_shape('rect',name,self._draw.rectangle,args,kwargs)
 
 
 
@@ -181,14 +409,10 @@ class Screen():
             line colour [default=0 (black)]
 
         """
-        if name is None:
-            name = 'line%i' % self.shape_counter
-            
         args = [xy]
         kwargs = {'width':width,'fill':fill}
 
-        self.shapes[name] = Shape(name,self._draw.line,args,kwargs)
-        self.shape_counter +=1
+        self._add_shape('line',name,self._draw.line,args,kwargs)
 
 
     def ellipse(self,xy,outline=0,fill=255,name=None):
@@ -208,15 +432,10 @@ class Screen():
             fill colour [default=255 (white)]
 
         """
-        if name is None:
-            name = 'ellipse%i' % self.shape_counter
-            
         args = [xy]
         kwargs = {'outline':outline,'fill':fill}
 
-        
-        self.shapes[name] = Shape(name,self._draw.ellipse,args,kwargs)
-        self.shape_counter +=1
+        self._add_shape('ellipse',name,self._draw.ellipse,args,kwargs)
 
 
     def polygon(self,xy,outline=0,fill=255,name=None):
@@ -236,15 +455,30 @@ class Screen():
             fill colour [default=255 (white)]
 
         """
-        if name is None:
-            name = 'polygon%i' % self.shape_counter
-            
         args = [xy]
         kwargs = {'outline':outline,'fill':fill}
 
-        
-        self.shapes[name] = Shape(name,self._draw.polygon,args,kwargs)
-        self.shape_counter +=1
+        self._add_shape('polygon',name,self._draw.polygon,args,kwargs)
+
+
+    def paste(self,image,xy,name=None):
+        """
+        Draw an image
+
+        Inputs
+        -----------
+        image : PIL image object
+            image to draw, changes to it are drawn on the next render
+
+        xy: list of int
+            x,y coordinates of top left corner of image
+            [x,y]
+
+        """
+        args = [image,tuple(xy)]
+        kwargs = {}
+
+        self._add_shape('image',name,self._image.paste,args,kwargs)
 
 
 ##    def text(self,xy,text_str,fill=0,font=None,name=None):
@@ -274,7 +508,7 @@ class Screen():
 
 
     def text(self,xy,text_str,rotation_deg=90,fill=0,
-             font=DEFAULT_FONT,fontsize=DEFAULT_FONT_SIZE,
+             font=None,fontsize=DEFAULT_FONT_SIZE,
              font_filename=DEFAULT_TRUETYPE_FONT,
              name=None):
         """
@@ -294,17 +528,19 @@ class Screen():
         fill : int
             text colour [default=0 (black)]
 
+        font : PIL font object
+            font to use, ignored if fontsize is not the default
+            [default=None (load font_filename)]
+
         """
-        if name is None:
-            name = 'text%i' % self.shape_counter
+        params = {'method':'text',
+                  'xy':xy,'text_str':text_str,'rotation_deg':rotation_deg,
+                  'fill':fill,'font':font,'fontsize':fontsize,
+                  'font_filename':font_filename}
 
         # Handle different font sizes
-        if fontsize!=DEFAULT_FONT_SIZE:
-            try:
-                # Load a different size font
-                font = ImageFont.truetype(font=font_filename, size=fontsize)
-            except:
-                font = DEFAULT_FONT
+        if font is None or fontsize!=DEFAULT_FONT_SIZE:
+            font = get_font(fontsize,font_filename)
                 
 
 
@@ -313,12 +549,12 @@ class Screen():
             args = [xy,text_str]
             kwargs = {'font':font,'fill':fill}
             
-            self.shapes[name] = Shape(name,self._draw.text,args,kwargs)
-            self.shape_counter +=1
+            self._add_shape('text',name,self._draw.text,args,kwargs,params)
+            return
 
         # Rotated text
         # ===============
-        img_txt = Image.new('1', font.getsize(text_str),255)
+        img_txt = Image.new('1', text_size(font,text_str),255)
         draw_txt = ImageDraw.Draw(img_txt)
         draw_txt.text((0,0), text_str, font=font, fill=fill)
         rotated_txt = img_txt.rotate(rotation_deg, expand=1)
@@ -326,8 +562,86 @@ class Screen():
         args = [rotated_txt,xy]
         kwargs = {}
 
-        self.shapes[name] = Shape(name,self._image.paste,args,kwargs)
-        self.shape_counter +=1
+        self._add_shape('text',name,self._image.paste,args,kwargs,params)
+
+
+    def text_box(self,xy,text_str,rotation_deg=90,fill=0,
+                 fontsize=None,font_filename=DEFAULT_TRUETYPE_FONT,
+                 align='left',valign='top',line_spacing=1.0,
+                 min_fontsize=6,max_fontsize=60,
+                 name=None):
+        """
+        Draw text wrapped to fit inside a box
+
+        Layouts are cached (see text_layout_lib), so drawing the same
+        text in the same box again is cheap.
+
+        Inputs
+        -----------
+        xy: list of int
+            x,y coordinates of two corners of the box
+            [x1,y1,x2,y2]
+
+        text_str: str
+            text to print, newlines start a new paragraph
+
+        rotation_deg : int
+            rotation of text, 0 or 90 [default=90]
+
+        fill : int
+            text colour [default=0 (black)]
+
+        fontsize : int or None
+            font size, None for the largest size between min_fontsize
+            and max_fontsize that fits the box [default=None]
+
+        font_filename : str
+            TrueType font file [default=DEFAULT_TRUETYPE_FONT]
+
+        align : str
+            'left', 'center' or 'right' [default='left']
+
+        valign : str
+            'top', 'middle' or 'bottom' [default='top']
+
+        line_spacing : float
+            distance between lines as a multiple of the line height
+            [default=1.0]
+
+        min_fontsize : int
+        max_fontsize : int
+            range of font sizes tried when fontsize is None
+
+        name : str
+            name of shape [default=None (automatic name)]
+
+        """
+        # text_layout_lib imports this module
+        import text_layout_lib
+
+        params = {'method':'text_box',
+                  'xy':xy,'text_str':text_str,'rotation_deg':rotation_deg,
+                  'fill':fill,'fontsize':fontsize,'font_filename':font_filename,
+                  'align':align,'valign':valign,'line_spacing':line_spacing,
+                  'min_fontsize':min_fontsize,'max_fontsize':max_fontsize}
+
+        x1,y1,x2,y2 = xy
+        size = (x2 - x1 + 1,y2 - y1 + 1)
+        if rotation_deg in (90,270):
+            # Text runs along the y axis of the screen
+            size = (size[1],size[0])
+
+        layout = text_layout_lib.get_layout(text_str,size,fontsize,font_filename,
+                                            align,valign,line_spacing,
+                                            min_fontsize,max_fontsize)
+        image = layout.image(fill)
+        if rotation_deg != 0:
+            image = image.rotate(rotation_deg,expand=1)
+
+        args = [image,(x1,y1)]
+        kwargs = {}
+
+        self._add_shape('textbox',name,self._image.paste,args,kwargs,params)
         
         
 # Ref: from StackOverflow
@@ -346,18 +660,38 @@ class Screen():
 
 
 
+class _AcquiredLock():
+    """
+    Context manager that releases a lock that is already acquired
+    """
+
+    def __init__(self,lock):
+        self.lock = lock
+
+    def __enter__(self):
+        return self.lock
+
+    def __exit__(self,*exc_info):
+        self.lock.release()
+
+
+
 class Shape():
     """
     Structure for a shape 
     """
 
-    def __init__(self,name,function,args,kwargs):
+    def __init__(self,name,function,args,kwargs,params=None):
         
         self.name = name
         self.function = function
         self.args = args
         self.kwargs = kwargs
 
+        # Arguments of the Screen method that made the shape, for
+        # shapes such as text that are not drawn from them directly
+        self.params = params
+
     def __repr__(self):
         return 'Shape(%s)' % self.name
 
@@ -0,0 +1,74 @@
+"""
+Tests for chart_lib
+
+Run with
+
+    python -m pytest test_chart_lib.py
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import unittest
+
+import numpy as np
+
+import screen_lib as scr
+import chart_lib
+
+
+class TestStripChartScroll(unittest.TestCase):
+    """
+    Scrolling on append() must give the same plot as redraw()
+    """
+
+    def check_scroll(self,step,width,n_samples=700):
+        """
+        Append samples with gaps to one chart and redraw a second chart
+        after every sample, the images must be the same
+        """
+        screen = scr.Screen(128,250)
+        scrolled = chart_lib.StripChart(screen,(0,0,127,63),step=step,width=width,
+                                        y_range=(0,10),name='scrolled')
+        redrawn = chart_lib.StripChart(screen,(0,64,127,127),step=step,width=width,
+                                       y_range=(0,10),name='redrawn')
+
+        rng = np.random.RandomState(2)
+        for i in range(n_samples):
+            value = rng.uniform(0,10) if rng.rand() > 0.15 else np.nan
+            scrolled.append(value)
+            redrawn.append(value)
+            redrawn.redraw()
+
+            n_wrong = (np.array(scrolled.image) != np.array(redrawn.image)).sum()
+            self.assertEqual(n_wrong,0,'%i pixels differ after sample %i' % (n_wrong,i))
+
+        # Only scrolled, never redrawn
+        self.assertEqual(scrolled.redraw_count,0)
+
+    def test_scroll_matches_redraw(self):
+        for step in range(1,7):
+            for width in range(1,6):
+                with self.subTest(step=step,width=width):
+                    self.check_scroll(step,width)
+
+
+if __name__ == '__main__':
+    unittest.main()
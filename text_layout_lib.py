@@ -0,0 +1,480 @@
+"""
+Text layout for Screen
+---------------------------------
+
+Lays out paragraphs of text inside a box: word wrapping, alignment,
+line spacing and choosing the largest font size that fits.
+
+Word widths are measured once for each (font, size) and whole layouts
+are cached, so laying out the same paragraph again costs a dictionary
+lookup. The caches are limited in size and can be used from several
+threads. Used by Screen.text_box().
+
+Example usage
+--------------
+
+Largest font size that fits a 120x60 box
+>>> layout = get_layout('Notice: the lift is out of order',(120,60),
+...                     fontsize=None,align='center')
+
+Font size chosen and (x,y,text) of each line
+>>> layout.fontsize
+>>> layout.lines
+
+Image of the text
+>>> image = layout.image()
+
+"""
+
+#  Copyright 2018  Redlegjed <rlj_github@nym.hush.com>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image,ImageDraw
+
+import screen_lib as scr
+
+# Font sizes tried when fitting text to a box
+MIN_FONT_SIZE = 6
+MAX_FONT_SIZE = 60
+
+# Number of layouts kept in the cache
+LAYOUT_CACHE_SIZE = 256
+
+# Number of string widths kept in the cache. Lines and parts of long
+# words are measured as well as words, so this is more than the words
+# likely to be on a screen.
+WIDTH_CACHE_SIZE = 4096
+
+# String widths in pixels, keyed on (font_filename,fontsize,text_str)
+_width_cache = OrderedDict()
+
+# Line heights in pixels, keyed on (font_filename,fontsize)
+_height_cache = {}
+
+# Layouts, keyed on all the arguments of get_layout()
+_layout_cache = OrderedDict()
+
+stats = {'layouts':0,'layout_cache_hits':0,
+         'measures':0,'measure_cache_hits':0}
+
+# Held while reading or changing the caches and stats, not while
+# measuring or laying out, which call text_width()
+_cache_lock = threading.Lock()
+
+
+
+# ===================================
+# Caches
+# ===================================
+
+def _cache_get(cache,key,hit_stat):
+    """
+    Return value from an LRU cache, None if not in it
+
+    Inputs
+    -----------
+    cache : OrderedDict
+
+    key : tuple
+
+    hit_stat : str
+        key in stats counting hits
+    """
+    with _cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            stats[hit_stat] += 1
+            cache.move_to_end(key)
+        return value
+
+
+def _cache_put(cache,key,value,size,miss_stat):
+    """
+    Add value to an LRU cache, dropping the least recently used
+    values if there are more than size
+
+    Inputs
+    -----------
+    cache : OrderedDict
+
+    key : tuple
+
+    value : object
+        not None
+
+    size : int
+        number of values kept
+
+    miss_stat : str
+        key in stats counting misses
+    """
+    with _cache_lock:
+        stats[miss_stat] += 1
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+
+
+# ===================================
+# Measurement
+# ===================================
+
+def text_width(text_str,fontsize=scr.DEFAULT_FONT_SIZE,
+               font_filename=scr.DEFAULT_TRUETYPE_FONT):
+    """
+    Width of a string in pixels, remembered for each font and size
+
+    Inputs
+    -----------
+    text_str : str
+
+    fontsize : int
+
+    font_filename : str
+
+    Output
+    --------
+    width : int
+    """
+    key = (font_filename,fontsize,text_str)
+    width = _cache_get(_width_cache,key,'measure_cache_hits')
+    if width is not None:
+        return width
+
+    font = scr.get_font(fontsize,font_filename)
+    if hasattr(font,'getlength'):
+        # advance width, includes spaces
+        width = int(math.ceil(font.getlength(text_str)))
+    else:
+        width = scr.text_size(font,text_str)[0]
+    _cache_put(_width_cache,key,width,WIDTH_CACHE_SIZE,'measures')
+    return width
+
+
+def line_height(fontsize=scr.DEFAULT_FONT_SIZE,font_filename=scr.DEFAULT_TRUETYPE_FONT):
+    """
+    Height of a line of text in pixels, without spacing
+
+    Inputs
+    -----------
+    fontsize : int
+
+    font_filename : str
+
+    Output
+    --------
+    height : int
+    """
+    key = (font_filename,fontsize)
+    with _cache_lock:
+        height = _height_cache.get(key)
+    if height is not None:
+        return height
+
+    # One value for each font and size, so no limit is needed
+    font = scr.get_font(fontsize,font_filename)
+    try:
+        ascent,descent = font.getmetrics()
+        height = ascent + descent
+    except AttributeError:
+        height = scr.text_size(font,'Ag')[1]
+
+    with _cache_lock:
+        _height_cache[key] = height
+    return height
+
+
+def clear_caches():
+    """
+    Forget all measurements and layouts
+    """
+    with _cache_lock:
+        _width_cache.clear()
+        _height_cache.clear()
+        _layout_cache.clear()
+
+
+
+# ===================================
+# Layout
+# ===================================
+
+class TextLayout():
+    """
+    Lines of text placed inside a box
+    """
+
+    def __init__(self,size,fontsize,font_filename,lines,fits):
+        """
+        Inputs
+        -----------
+        size : tuple
+            (width,height) of box
+
+        fontsize : int
+
+        font_filename : str
+
+        lines : list
+            (x,y,text) of each line, relative to the top left of box
+
+        fits : bool
+            False if the text does not fit in the box
+        """
+        self.size = size
+        self.fontsize = fontsize
+        self.font_filename = font_filename
+        self.lines = lines
+        self.fits = fits
+        self._images = {}
+
+    def __repr__(self):
+        return 'TextLayout(%i lines, size %i)' % (len(self.lines),self.fontsize)
+
+    def image(self,fill=0):
+        """
+        Return the layout drawn on an image the size of the box
+
+        The image is drawn once and kept, do not change it.
+
+        Inputs
+        -----------
+        fill : int
+            text colour [default=0 (black)]
+
+        Output
+        --------
+        image : PIL image object
+        """
+        if fill not in self._images:
+            image = Image.new('1',self.size,255 if fill == 0 else 0)
+            draw = ImageDraw.Draw(image)
+            font = scr.get_font(self.fontsize,self.font_filename)
+            for x,y,text_str in self.lines:
+                draw.text((x,y),text_str,font=font,fill=fill)
+            self._images[fill] = image
+
+        return self._images[fill]
+
+
+def wrap_text(text_str,width,fontsize=scr.DEFAULT_FONT_SIZE,
+              font_filename=scr.DEFAULT_TRUETYPE_FONT):
+    """
+    Split text into lines that fit a width
+
+    Words are kept whole unless a word is wider than the box by itself.
+    Newlines in text_str start a new line.
+
+    Inputs
+    -----------
+    text_str : str
+
+    width : int
+        width of box in pixels
+
+    fontsize : int
+
+    font_filename : str
+
+    Output
+    --------
+    lines : list of str
+
+    broken : bool
+        True if a word had to be split
+    """
+    measure = lambda s: text_width(s,fontsize,font_filename)
+    space = measure(' ')
+
+    lines = []
+    broken = False
+    for paragraph in text_str.split('\n'):
+        line = []
+        line_width = 0
+        for word in paragraph.split():
+            word_width = measure(word)
+
+            # Split words too long for a line by themselves
+            while word_width > width and len(word) > 1:
+                broken = True
+                if line:
+                    lines.append(' '.join(line))
+                    line = []
+                    line_width = 0
+                n = _longest_prefix(word,width,measure)
+                lines.append(word[:n])
+                word = word[n:]
+                word_width = measure(word)
+
+            if line and line_width + space + word_width > width:
+                lines.append(' '.join(line))
+                line = []
+                line_width = 0
+
+            line_width += word_width + (space if line else 0)
+            line.append(word)
+
+        lines.append(' '.join(line))
+
+    return lines,broken
+
+
+def _longest_prefix(word,width,measure):
+    """
+    Number of characters at the start of word that fit in width, at least 1
+    """
+    lo,hi = 1,len(word)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if measure(word[:mid]) <= width:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def layout_text(text_str,size,fontsize=scr.DEFAULT_FONT_SIZE,
+                font_filename=scr.DEFAULT_TRUETYPE_FONT,
+                align='left',valign='top',line_spacing=1.0):
+    """
+    Lay out text in a box at one font size, without the cache
+
+    See get_layout() for inputs
+
+    Output
+    --------
+    layout : TextLayout object
+    """
+    width,height = size
+    lines,broken = wrap_text(text_str,width,fontsize,font_filename)
+
+    step = int(round(line_height(fontsize,font_filename) * line_spacing))
+    total_height = step * (len(lines) - 1) + line_height(fontsize,font_filename)
+
+    if valign == 'middle':
+        y = (height - total_height) // 2
+    elif valign == 'bottom':
+        y = height - total_height
+    else:
+        y = 0
+
+    placed = []
+    for line in lines:
+        line_width = text_width(line,fontsize,font_filename)
+        if align == 'center':
+            x = (width - line_width) // 2
+        elif align == 'right':
+            x = width - line_width
+        else:
+            x = 0
+        placed.append((x,y,line))
+        y += step
+
+    fits = (not broken and total_height <= height
+            and all(text_width(line,fontsize,font_filename) <= width for line in lines))
+
+    return TextLayout(size,fontsize,font_filename,placed,fits)
+
+
+def get_layout(text_str,size,fontsize=None,
+               font_filename=scr.DEFAULT_TRUETYPE_FONT,
+               align='left',valign='top',line_spacing=1.0,
+               min_fontsize=MIN_FONT_SIZE,max_fontsize=MAX_FONT_SIZE):
+    """
+    Lay out text in a box, using the cache
+
+    Inputs
+    -----------
+    text_str : str
+        text, newlines start a new paragraph
+
+    size : tuple
+        (width,height) of box in pixels
+
+    fontsize : int or None
+        font size, None to use the largest size between min_fontsize
+        and max_fontsize that fits the box [default=None]
+
+    font_filename : str
+        TrueType font file [default=DEFAULT_TRUETYPE_FONT]
+
+    align : str
+        'left', 'center' or 'right' [default='left']
+
+    valign : str
+        'top', 'middle' or 'bottom' [default='top']
+
+    line_spacing : float
+        distance between lines as a multiple of the line height
+        [default=1.0]
+
+    min_fontsize : int
+    max_fontsize : int
+        range of font sizes tried when fontsize is None
+
+    Output
+    --------
+    layout : TextLayout object
+    """
+    key = (text_str,tuple(size),fontsize,font_filename,align,valign,line_spacing,
+           min_fontsize,max_fontsize)
+    layout = _cache_get(_layout_cache,key,'layout_cache_hits')
+    if layout is not None:
+        return layout
+
+    # Laid out outside the lock. Two threads may lay out the same
+    # text at once, both get the same layout.
+    if fontsize is not None:
+        layout = layout_text(text_str,size,fontsize,font_filename,align,valign,line_spacing)
+    else:
+        layout = _fit_layout(text_str,size,font_filename,align,valign,line_spacing,
+                             min_fontsize,max_fontsize)
+
+    _cache_put(_layout_cache,key,layout,LAYOUT_CACHE_SIZE,'layouts')
+    return layout
+
+
+def _fit_layout(text_str,size,font_filename,align,valign,line_spacing,
+                min_fontsize,max_fontsize):
+    """
+    Binary search for the largest font size whose layout fits the box
+    """
+    best = None
+    lo,hi = min_fontsize,max_fontsize
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        layout = layout_text(text_str,size,mid,font_filename,align,valign,line_spacing)
+        if layout.fits:
+            best = layout
+            lo = mid + 1
+        else:
+            hi = mid - 1
+
+    if best is None:
+        # Nothing fits, use the smallest size
+        best = layout_text(text_str,size,min_fontsize,font_filename,
+                           align,valign,line_spacing)
+
+    return best
@@ -51,11 +51,36 @@ Clear screen to blank image
 # ===================================
 # Imports
 # ===================================
-import spidev
-import RPi.GPIO as GPIO
+import os
+import json
+import base64
 import time
-from PIL import Image
+import threading
 import screen_lib as scr
+import lut_lib
+from lut_lib import LUT_FULL_UPDATE,LUT_PARTIAL_UPDATE
+
+# spidev and RPi.GPIO are only imported when the first EPD object is
+# created, see load_hardware_modules()
+spidev = None
+GPIO = None
+
+
+def load_hardware_modules():
+    """
+    Import the Raspberry Pi hardware modules (spidev and RPi.GPIO)
+
+    Deferred until an EPD object is created so that this module can
+    be imported for its constants and frame functions on machines
+    without the display attached.
+    """
+    global spidev,GPIO
+
+    if GPIO is None:
+        import spidev as _spidev
+        import RPi.GPIO as _GPIO
+        spidev = _spidev
+        GPIO = _GPIO
 
 # ===================================
 # Setup
@@ -94,26 +119,230 @@ SET_RAM_X_ADDRESS_COUNTER                   = 0x4E
 SET_RAM_Y_ADDRESS_COUNTER                   = 0x4F
 TERMINATE_FRAME_READ_WRITE                  = 0xFF
 
-# Full update - flickers
-LUT_FULL_UPDATE = [
-    0x22, 0x55, 0xAA, 0x55, 0xAA, 0x55, 0xAA, 0x11,
-    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-    0x1E, 0x1E, 0x1E, 0x1E, 0x1E, 0x1E, 0x1E, 0x1E,
-    0x01, 0x00, 0x00, 0x00, 0x00, 0x00
-]
-
-# Partial update - smoother
-LUT_PARTIAL_UPDATE  = [
-    0x18, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-    0x0F, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-    0x00, 0x00, 0x00, 0x00, 0x00, 0x00
-]
+# Look up tables LUT_FULL_UPDATE and LUT_PARTIAL_UPDATE, and the
+# other presets, are in lut_lib
 
 # SPI device, bus = 0, device = 0
 #SPI = spidev.SpiDev(0, 0)
 #SPI = spidev.SpiDev(0, 1)
 
+# Largest block of bytes spidev will send in one transfer
+SPI_MAX_TRANSFER = 4096
+
+# State file written by EPD.save_state()
+STATE_FILE_VERSION = 2
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+
+
+# ===================================
+# Frame functions
+# ===================================
+# A frame is the packed image held in the screen RAM:
+# 1 bit per pixel (1=white), 8 pixels per byte with the left most
+# pixel in the most significant bit, rows of width/8 bytes
+# starting at the top of the screen.
+
+def pack_image(image):
+    """
+    Convert an image into a packed frame
+
+    Inputs
+    -------
+    image : PIL image object
+        Image with the same dimensions as the screen
+
+    Output
+    --------
+    frame : bytes
+        packed frame, width/8 bytes per row
+    """
+    # PIL stores mode '1' images in the same format as the screen RAM
+    return image.convert('1').tobytes()
+
+
+def frame_window(old_frame,new_frame,width,height):
+    """
+    Find the window of a frame that has changed
+
+    Inputs
+    -------
+    old_frame : bytes or None
+        frame currently in screen RAM, None if unknown
+
+    new_frame : bytes
+        new frame
+
+    width : int
+    height : int
+        dimensions of the screen in pixels
+
+    Output
+    --------
+    window : tuple or None
+        (x_start,y_start,x_end,y_end) in pixels of the changed area,
+        x is aligned to whole bytes. None if the frames are the same.
+    """
+    if old_frame is None:
+        return (0,0,width-1,height-1)
+
+    if old_frame == new_frame:
+        return None
+
+    row_bytes = width // 8
+
+    # Rows that have changed
+    rows = [y for y in range(height)
+            if old_frame[y*row_bytes:(y+1)*row_bytes] != new_frame[y*row_bytes:(y+1)*row_bytes]]
+    y_start = rows[0]
+    y_end = rows[-1]
+
+    # Byte columns that have changed inside those rows
+    band_old = old_frame[y_start*row_bytes:(y_end+1)*row_bytes]
+    band_new = new_frame[y_start*row_bytes:(y_end+1)*row_bytes]
+    cols = [xb for xb in range(row_bytes)
+            if band_old[xb::row_bytes] != band_new[xb::row_bytes]]
+
+    return (cols[0]*8,y_start,cols[-1]*8 + 7,y_end)
+
+
+def frame_window_bytes(frame,window,width):
+    """
+    Return the bytes of a frame inside a window
+
+    Inputs
+    -------
+    frame : bytes
+        packed frame
+
+    window : tuple
+        (x_start,y_start,x_end,y_end) in pixels, x is rounded
+        to whole bytes
+
+    width : int
+        width of the screen in pixels
+
+    Output
+    --------
+    data : bytes
+        bytes in the window in the order they are written to screen RAM
+    """
+    x_start,y_start,x_end,y_end = window
+    row_bytes = width // 8
+    xb_start = x_start >> 3
+    xb_end = x_end >> 3
+
+    return b''.join([frame[y*row_bytes + xb_start:y*row_bytes + xb_end + 1]
+                     for y in range(y_start,y_end + 1)])
+
+
+def set_frame_window_bytes(frame,window,data,width):
+    """
+    Copy bytes for a window into a frame
+
+    Inputs
+    -------
+    frame : bytearray
+        packed frame, changed in place
+
+    window : tuple
+        (x_start,y_start,x_end,y_end) in pixels, x is rounded
+        to whole bytes
+
+    data : bytes
+        bytes in the window, as returned by frame_window_bytes()
+
+    width : int
+        width of the screen in pixels
+    """
+    x_start,y_start,x_end,y_end = window
+    row_bytes = width // 8
+    xb_start = x_start >> 3
+    window_row_bytes = (x_end >> 3) - xb_start + 1
+
+    for i,y in enumerate(range(y_start,y_end + 1)):
+        start = y*row_bytes + xb_start
+        frame[start:start + window_row_bytes] = \
+            data[i*window_row_bytes:(i+1)*window_row_bytes]
+
+
+def align_window(window,width,height):
+    """
+    Round a window out to whole bytes in x and clip it to the screen
+
+    Inputs
+    -------
+    window : tuple
+        (x_start,y_start,x_end,y_end) in pixels
+
+    width : int
+    height : int
+        dimensions of the screen in pixels
+
+    Output
+    --------
+    window : tuple
+        (x_start,y_start,x_end,y_end)
+    """
+    x_start,y_start,x_end,y_end = window
+    return (max(0,x_start & ~7),max(0,y_start),
+            min(width - 1,x_end | 7),min(height - 1,y_end))
+
+
+def next_minute(t=None):
+    """
+    Return the time of the start of the next minute
+
+    Inputs
+    -------
+    t : float
+        time in seconds since the epoch [Default None (now)]
+
+    Output
+    --------
+    deadline : float
+        time in seconds since the epoch, for EPD.update_at()
+    """
+    if t is None:
+        t = time.time()
+    return (int(t) // 60 + 1) * 60.0
+
+
+def sleep_until(t,spin_s=0.002):
+    """
+    Sleep until a time
+
+    Sleeps until just before the time then polls the clock for the last
+    spin_s seconds, time.sleep() alone can overshoot by milliseconds.
+
+    Inputs
+    -------
+    t : float
+        time in seconds since the epoch
+
+    spin_s : float
+        time to poll for at the end [Default 2ms]
+    """
+    while True:
+        remaining = t - time.time()
+        if remaining <= 0:
+            return
+        if remaining > spin_s:
+            time.sleep(remaining - spin_s)
+
+
+def read_boot_id():
+    """
+    Return an ID that changes every time the R-Pi boots
+
+    Used to spot a state file left over from before a reboot, when the
+    screen controller will have been reset.
+    """
+    try:
+        with open(BOOT_ID_FILE) as f:
+            return f.read().strip()
+    except (IOError,OSError):
+        return ''
 
 
 
@@ -142,7 +371,8 @@ class EPD(scr.Screen):
                  spi_bus=0,spi_dev=1,
                  width=128,height=250,
                  lut_full_update=LUT_FULL_UPDATE,
-                 lut_partial_update=LUT_PARTIAL_UPDATE):
+                 lut_partial_update=LUT_PARTIAL_UPDATE,
+                 state_file=None):
         """
         Initialise class
         * Setup pins
@@ -178,9 +408,18 @@ class EPD(scr.Screen):
         lut_partial_update : list
             Lookup table for partial update of screen
             Supplied by manufacturer
+
+        state_file : str
+            File used to keep the state of the screen controller
+            between processes. If the controller is still initialised
+            from the last process the reset and init sequence is
+            skipped and only the changes to the frame on the screen
+            are sent. Best kept on a tmpfs such as /run or /dev/shm.
+            [Default None (always do full initialisation)]
         
         """
         scr.Screen.__init__(self,width,height)
+        load_hardware_modules()
         
         # Setup pins
         self.reset_pin = reset_pin
@@ -192,28 +431,583 @@ class EPD(scr.Screen):
         self.lut_partial_update = lut_partial_update
         self.lut_full_update = lut_full_update
         self.lut = self.lut_full_update
+        self.lut_name = None
+        self.temperature = None
+
+        # Preset asked for in use_lut(), lut_name is the variant of it
+        # loaded for the temperature. None for a custom LUT.
+        self.lut_preset = None
+
+        # Refresh times for each LUT, see record_busy_time()
+        self.lut_stats = {}
+
+        # Time between checks of the busy pin
+        self.busy_poll_ms = 5
     
 
         # Connect to screen over SPI
         self.SPI = spidev.SpiDev(spi_bus, spi_dev)
 
+        # Screen RAM
+        # The controller has two RAM banks, writes go to the bank that
+        # is not on display and display_frame() swaps them over.
+        # frame_banks has the packed frame in each bank, None if unknown
+        self.frame_banks = [None,None]
+        self.active_bank = 0
+        self.mode = None
+        self.asleep = False
+        self.state_file = state_file
+
+        # Held while talking to the screen, so updates from different
+        # threads do not interleave. Shapes can still be changed.
+        # Take it with _locked_panel() to record contention.
+        self._panel_lock = threading.RLock()
+
+        # Time the last display update was started
+        self.activation_time = None
+
+        # shape_version and frame of the last whole screen update(),
+        # to skip rendering when neither has changed since
+        self._shown_version = None
+        self._shown_frame = None
+
+        self.stats.update({'deadline_updates':0,
+                           'activation_offset_s':None,
+                           'activation_offset_max_s':0.0,
+                           'preload_s':None,
+                           'preload_max_s':0.0,
+                           'refreshes':0,
+                           'refreshes_avoided':0,
+                           'renders_avoided':0,
+                           'panel_lock_contention':0,
+                           'panel_lock_wait_s':0.0,
+                           'panel_lock_wait_max_s':0.0})
+
         # Initialise screen
+        # On a warm start the controller is still set up by the last
+        # process so the reset and init sequence can be skipped
         self.epd_init()
-        self.set_to_partial_update()
+        self.warm_start = self.load_state()
+        if self.warm_start:
+            # last process may have left a different LUT loaded
+            self.use_lut('partial')
+        else:
+            self.set_to_partial_update()
 
 
     
 
 
-    def update(self):
+    def update(self,region=None,lut=None,force=False):
         """
         Update screen.
         Run this after making changes to a screen
+
+        Inputs
+        -------
+        region : tuple
+            (x_start,y_start,x_end,y_end) in pixels. Only this part
+            of the image is packed and sent, the rest of the screen
+            is left as it is. [Default None (whole screen)]
+
+        lut : str or list
+            LUT to use for this and later updates, see use_lut()
+            [Default None (keep current LUT)]
+
+        force : bool
+            refresh even if the frame is the same as the one on the
+            screen [Default False]
+
+        Output
+        --------
+        refreshed : bool
+            False if the screen already showed the shapes
+        """
+        # Render inside the panel lock, so when two threads update at
+        # once the later render is the one left on the screen. Threads
+        # changing shapes only take the shape lock and are not blocked.
+        with self._locked_panel():
+            # No shape has changed and nothing else has been written
+            # to the screen since the last update, so the frame would
+            # be the same. Skip rendering and packing it.
+            if (not force and region is None
+                and self._shown_version == self.shape_version
+                and self._shown_frame is not None
+                and self._shown_frame == self.frame_banks[self.active_bank]):
+                if lut is not None:
+                    self.use_lut(lut)
+                self.stats['renders_avoided'] += 1
+                self.stats['refreshes_avoided'] += 1
+                return False
+
+            image,version = self.render()
+            refreshed = self.update_frame(self.image_to_frame(image,region),lut,force)
+            if region is None:
+                self._shown_version = version
+                self._shown_frame = self.frame_banks[self.active_bank]
+            return refreshed
+
+
+    def image_to_frame(self,image,region=None):
         """
+        Pack an image into a frame
+
+        Inputs
+        -------
+        image : PIL image object
+            image of the whole screen
+
+        region : tuple
+            (x_start,y_start,x_end,y_end) in pixels. Only this part
+            of the image is packed, the rest of the frame is what is
+            on the screen. [Default None (whole screen)]
+
+        Output
+        --------
+        frame : bytes
+            packed frame
+        """
+        on_screen = self.frame_banks[self.active_bank]
+        if region is None or on_screen is None:
+            return pack_image(image)
+
+        x_start,y_start,x_end,y_end = window = align_window(region,self.width,self.height)
+        data = pack_image(image.crop((x_start,y_start,x_end + 1,y_end + 1)))
+        frame = bytearray(on_screen)
+        set_frame_window_bytes(frame,window,data,self.width)
+        return bytes(frame)
+
+
+    def preload(self,region=None,lut=None):
+        """
+        Render the shapes and write the frame into the RAM bank that
+        is not on display, without displaying it.
+        Use activate_display() to show it.
+
+        Inputs
+        -------
+        region : tuple
+            see update()
+
+        lut : str or list
+            see update()
+        """
+        t_start = time.time()
+        with self._locked_panel():
+            # Render inside the lock, see update()
+            image = self.image
+            if lut is not None:
+                self.use_lut(lut)
+            self.write_frame(self.image_to_frame(image,region))
+            self.set_display_update()
+            # activate_display() may never be called by this process
+            self.save_state()
+
+        preload_s = time.time() - t_start
+        self.stats['preload_s'] = preload_s
+        self.stats['preload_max_s'] = max(self.stats['preload_max_s'],preload_s)
+
+
+    def update_at(self,deadline,prepare=None,region=None,lut=None,lead_time=None):
+        """
+        Show the shapes on the screen at a deadline
+
+        The frame is rendered and written into the RAM bank that is not
+        on display before the deadline, so at the deadline only the
+        activation command is sent.
+
+        Inputs
+        -------
+        deadline : float
+            time to show frame, seconds since the epoch (see next_minute())
+
+        prepare : function
+            called as prepare(epd) just before rendering, to set up
+            the shapes for the deadline [Default None]
+
+        region : tuple
+            see update()
+
+        lut : str or list
+            see update()
+
+        lead_time : float
+            seconds before the deadline to start rendering
+            [Default None (twice the longest preload so far, at least 0.5s)]
+
+        Output
+        --------
+        offset : float
+            seconds from the deadline to the activation command being
+            sent, negative if early
+        """
+        if lead_time is None:
+            lead_time = max(0.5,2 * self.stats['preload_max_s'])
+
+        sleep_until(deadline - lead_time)
+
+        # Hold the panel lock until activation so no other update
+        # overwrites the preloaded bank
+        with self._locked_panel():
+            if prepare is not None:
+                prepare(self)
+            self.preload(region,lut)
+
+            sleep_until(deadline)
+            self.activate_display()
+
+        offset = self.activation_time - deadline
+        self.stats['deadline_updates'] += 1
+        self.stats['activation_offset_s'] = offset
+        self.stats['activation_offset_max_s'] = max(self.stats['activation_offset_max_s'],
+                                                    abs(offset))
+        return offset
+
+
+    def update_frame(self,frame,lut=None,force=False):
+        """
+        Send a packed frame to the screen and display it.
+        Nothing is done if the frame is already on the screen.
+
+        Inputs
+        -------
+        frame : bytes
+            packed frame, see pack_image()
+
+        lut : str or list
+            see update()
+
+        force : bool
+            see update()
+
+        Output
+        --------
+        refreshed : bool
+            False if the frame was already on the screen
+        """
+
+        with self._locked_panel():
+            # The LUT is for later updates too, so load it even if
+            # this one is skipped
+            if lut is not None:
+                self.use_lut(lut)
+
+            # frame_banks holds the whole frame, comparing it is as
+            # cheap as comparing a hash of it
+            if not force and frame == self.frame_banks[self.active_bank]:
+                self.stats['refreshes_avoided'] += 1
+                return False
+
+            self.stats['refreshes'] += 1
+            self.write_frame(frame)
+            self.display_frame()
+
+        return True
+
+
+    def write_frame(self,frame):
+        """
+        Write a packed frame into the RAM bank that is not on display.
+        Only the window that differs from what is already in the
+        bank is sent.
+
+        Inputs
+        -------
+        frame : bytes
+            packed frame, see pack_image()
+        """
+        bank = 1 - self.active_bank
+        window = frame_window(self.frame_banks[bank],frame,self.width,self.height)
+        if window is not None:
+            self.invalidate_bank(bank)
+            self.write_window(frame,window)
+
+        self.frame_banks[bank] = bytes(frame)
+
+
+    def invalidate_bank(self,bank):
+        """
+        Mark the contents of a RAM bank as unknown, in memory and in
+        the state file, before writing to it.
+
+        If the process stops part way through a write, or between a
+        write and activate_display(), the next warm start then sends
+        the whole frame rather than a diff against the wrong contents.
+
+        Inputs
+        -------
+        bank : int
+            0 or 1
+        """
+        if self.frame_banks[bank] is not None:
+            self.frame_banks[bank] = None
+            self.save_state()
+
+
+    def write_window(self,frame,window):
+        """
+        Send a window of a packed frame to the screen RAM
+
+        Inputs
+        -------
+        frame : bytes
+            packed frame
+
+        window : tuple
+            (x_start,y_start,x_end,y_end) in pixels, x is rounded
+            to whole bytes
+        """
+        x_start,y_start,x_end,y_end = window
+        self.set_memory_area(x_start,y_start,x_end,y_end)
+        self.set_memory_pointer(x_start,y_start)
+        self.send_command(WRITE_RAM)
+        self.send_data_bytes(frame_window_bytes(frame,window,self.width))
+
+
+    def apply_frame_records(self,stream,show_each=False):
+        """
+        Show frames encoded by frame_codec.FrameEncoder
+
+        The stream is decoded against the frame on the screen, without
+        making an image, and the last frame is shown with one refresh.
+
+        The windows in the records are not used for the upload. They
+        are the change from the previous frame, but the frame is
+        written to the RAM bank that is not on display, which holds the
+        frame before that. update_frame() finds the window to send
+        from what is actually in that bank.
+
+        Inputs
+        -------
+        stream : bytes or file object
+            encoded frames
+
+        show_each : bool
+            refresh the screen for every frame in the stream, e.g. for
+            an animation, rather than only the last [Default False]
+
+        Output
+        --------
+        count : int
+            number of records applied
+        """
+        # frame_codec imports this module
+        import frame_codec
+
+        decoder = frame_codec.FrameDecoder(self.width,self.height,
+                                           reference=self.frame_banks[self.active_bank])
+        frame = None
+        count = 0
+        for record in frame_codec.iter_records(stream):
+            frame = decoder.decode(record)
+            if show_each and record.kind != frame_codec.REPEAT:
+                self.update_frame(frame)
+            count += 1
+
+        if frame is not None and not show_each:
+            self.update_frame(frame)
+
+        return count
+
+
+    # ------------------------------------------------------
+    # Look up tables
+    # ------------------------------------------------------
+
+    def use_lut(self,lut):
+        """
+        Load a LUT, unless it is already loaded.
+        Unlike set_to_full_update() and set_to_partial_update() this
+        does not reset the screen.
+
+        Inputs
+        -------
+        lut : str or list
+            Name of a preset in lut_lib.LUT_PRESETS or a 30 byte LUT.
+            'full' and 'partial' are the LUTs given to EPD(). When the
+            temperature is set the cold variant of a preset is used
+            below lut_lib.COLD_TEMPERATURE, and set_temperature()
+            changes variant as the temperature changes.
+        """
+        if isinstance(lut,str):
+            preset = lut
+            name = lut_lib.select_lut(lut,self.temperature)
+            if name == 'full':
+                data = self.lut_full_update
+            elif name == 'partial':
+                data = self.lut_partial_update
+            else:
+                data = lut_lib.LUT_PRESETS[name].data
+            mode = lut_lib.LUT_PRESETS[name].mode
+        else:
+            preset = None
+            name = 'custom'
+            data = lut_lib.validate_lut(lut)
+            mode = self.mode
+
+        with self._locked_panel():
+            self.lut_preset = preset
+            if name != self.lut_name or list(data) != list(self.lut):
+                self.set_lut(data)
+                self.lut_name = name
+                self.mode = mode
+                self.save_state()
+
+
+    def set_temperature(self,temperature):
+        """
+        Set the temperature of the screen
+
+        Written to the temperature register of the screen controller
+        and used to pick the LUT variant, see use_lut(). The loaded
+        LUT changes to the cold variant of its preset, or back, if
+        needed. Safe to call from another thread, e.g. one reading a
+        sensor.
+
+        Inputs
+        -------
+        temperature : float
+            deg C, from a sensor near the screen
+        """
+        # 12 bit register in 1/16 deg C
+        value = int(round(temperature * 16)) & 0xFFF
+
+        # Not in the middle of another thread's update
+        with self._locked_panel():
+            self.temperature = temperature
+            self.send_command(TEMPERATURE_SENSOR_CONTROL)
+            self.send_data((value >> 4) & 0xFF)
+            self.send_data((value << 4) & 0xF0)
+
+            if self.lut_preset is not None:
+                self.use_lut(self.lut_preset)
+
+
+    def record_busy_time(self,busy_s):
+        """
+        Add the time a refresh kept the screen busy to self.lut_stats
+
+        Inputs
+        -------
+        busy_s : float
+            time from activation to the screen being idle [s]
+        """
+        stats = self.lut_stats.setdefault(self.lut_name,
+                                          {'count':0,'total_s':0.0,
+                                           'min_s':busy_s,'max_s':busy_s})
+        stats['count'] += 1
+        stats['total_s'] += busy_s
+        stats['min_s'] = min(stats['min_s'],busy_s)
+        stats['max_s'] = max(stats['max_s'],busy_s)
+        stats['mean_s'] = stats['total_s'] / stats['count']
+        stats['last_s'] = busy_s
+
+
+    def _locked_panel(self):
+        """
+        Acquire panel lock, recording contention in self.stats
+
+        Waits can be long, e.g. update_at() holds the lock until its
+        deadline.
+
+        Output
+        --------
+        lock : threading.RLock
+            lock already acquired, use in a with statement to release
+        """
+        if not self._panel_lock.acquire(False):
+            t_start = time.time()
+            self._panel_lock.acquire()
+            wait_s = time.time() - t_start
+            self.stats['panel_lock_contention'] += 1
+            self.stats['panel_lock_wait_s'] += wait_s
+            self.stats['panel_lock_wait_max_s'] = max(self.stats['panel_lock_wait_max_s'],
+                                                      wait_s)
+
+        return scr._AcquiredLock(self._panel_lock)
+
+
+    # ------------------------------------------------------
+    # Persisted state
+    # ------------------------------------------------------
+
+    def load_state(self):
+        """
+        Load the screen controller state saved by a previous process
+
+        Output
+        --------
+        warm : bool
+            True if the controller is still initialised in partial
+            update mode and the contents of its RAM are known
+        """
+        if self.state_file is None:
+            return False
+
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+
+            if (state['version'] != STATE_FILE_VERSION
+                or state['width'] != self.width
+                or state['height'] != self.height
+                or state['boot_id'] != read_boot_id()):
+                return False
+
+            frame_size = self.width * self.height // 8
+            banks = [None if b is None else base64.b64decode(b)
+                     for b in state['banks']]
+            if len(banks) != 2 or any(b is not None and len(b) != frame_size
+                                      for b in banks):
+                return False
+
+            if state['asleep'] or state['mode'] != 'partial':
+                return False
+
+            active_bank = int(state['active_bank']) & 1
+            lut = lut_lib.validate_lut(state['lut'])
+            lut_name = state['lut_name']
+
+        except (IOError,OSError,ValueError,KeyError,TypeError):
+            return False
+
+        self.frame_banks = banks
+        self.active_bank = active_bank
+        self.mode = state['mode']
+        self.lut = lut
+        self.lut_name = lut_name
+        self.asleep = False
+
+        return True
+
+
+    def save_state(self):
+        """
+        Save the screen controller state to the state file, if there
+        is one.
+        """
+        if self.state_file is None:
+            return
+
+        state = {'version':STATE_FILE_VERSION,
+                 'width':self.width,
+                 'height':self.height,
+                 'boot_id':read_boot_id(),
+                 'mode':self.mode,
+                 'lut':list(self.lut),
+                 'lut_name':self.lut_name,
+                 'asleep':self.asleep,
+                 'active_bank':self.active_bank,
+                 'banks':[None if b is None else base64.b64encode(b).decode('ascii')
+                          for b in self.frame_banks]}
+
+        # Write to a temporary file first so a crash never leaves
+        # a half written state file
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file,'w') as f:
+            json.dump(state,f)
+        os.replace(tmp_file,self.state_file)
 
-        self.set_frame_memory(self.image,0,0)
-        self.display_frame()
-        
 
         
     def epd_init(self):
@@ -251,12 +1045,21 @@ class EPD(scr.Screen):
         # so use [data] instead of data
         self.spi_transfer([data])
 
+    def send_data_bytes(self, data):
+        self.digital_write(self.dc_pin, GPIO.HIGH)
+        # send in blocks rather than one transfer per byte
+        for i in range(0, len(data), SPI_MAX_TRANSFER):
+            self.spi_transfer(list(data[i:i + SPI_MAX_TRANSFER]))
+
     def init(self, lut):
         if (self.epd_init() != 0):
             return -1
         # EPD hardware init start
         #self.lut = lut
         self.reset()
+        # RAM contents are not known after a reset
+        self.frame_banks = [None,None]
+        self.asleep = False
         self.send_command(DRIVER_OUTPUT_CONTROL)
         self.send_data((self.height - 1) & 0xFF)
         self.send_data(((self.height - 1) >> 8) & 0xFF)
@@ -279,13 +1082,23 @@ class EPD(scr.Screen):
 
     def set_to_full_update(self):
         self.init(self.lut_full_update)
+        self.lut_name = 'full'
+        self.mode = 'full'
+        # cold variant, if the temperature needs it
+        self.use_lut('full')
+        self.save_state()
 
     def set_to_partial_update(self):
         self.init(self.lut_partial_update)
+        self.lut_name = 'partial'
+        self.mode = 'partial'
+        # cold variant, if the temperature needs it
+        self.use_lut('partial')
+        self.save_state()
 
     def wait_until_idle(self):
         while(self.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            self.delay_ms(100)
+            self.delay_ms(self.busy_poll_ms)
 ##
  #  @brief: module reset.
  #          often used to awaken the module in deep sleep,
@@ -300,7 +1113,7 @@ class EPD(scr.Screen):
  #  @brief: set the look-up table register
  ##
     def set_lut(self, lut):
-        lut = lut
+        self.lut = lut
         self.send_command(WRITE_LUT_REGISTER)
         # the length of look-up table is 30 bytes
         for i in range(0, len(lut)):
@@ -310,22 +1123,13 @@ class EPD(scr.Screen):
  #  @brief: convert an image to a buffer
  ##
     def get_frame_buffer(self, image):
-        buf = [0x00] * (self.width * self.height / 8)
-        # Set buffer to value of Python Imaging Library image.
-        # Image must be in mode 1.
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
+        # Image must be same size as the display
+        imwidth, imheight = image.size
         if imwidth != self.width or imheight != self.height:
             raise ValueError('Image must be same dimensions as display \
                 ({0}x{1}).' .format(self.width, self.height))
 
-        pixels = image_monocolor.load()
-        for y in range(self.height):
-            for x in range(self.width):
-                # Set the bits for the column of pixels at the current position.
-                if pixels[x, y] != 0:
-                    buf[(x + y * self.width) / 8] |= 0x80 >> (x % 8)
-        return buf
+        return list(pack_image(image))
 
 ##
  #  @brief: put an image to the frame memory.
@@ -347,6 +1151,8 @@ class EPD(scr.Screen):
             y_end = self.height - 1
         else:
             y_end = y + image_height - 1
+        # contents of bank are no longer tracked
+        self.invalidate_bank(1 - self.active_bank)
         self.set_memory_area(x, y, x_end, y_end)
         # send the image data
         pixels = image_monocolor.load()
@@ -368,12 +1174,14 @@ class EPD(scr.Screen):
  #          this won't update the display.
  ##
     def clear_frame_memory(self, color):
+        self.invalidate_bank(1 - self.active_bank)
         self.set_memory_area(0, 0, self.width - 1, self.height - 1)
         self.set_memory_pointer(0, 0)
         self.send_command(WRITE_RAM)
         # send the color data
         for i in range(0, int(self.width / 8 * self.height)): # added int() [JDB]
             self.send_data(color)
+        self.frame_banks[1 - self.active_bank] = bytes([color]) * int(self.width / 8 * self.height)
 
 ##
  #  @brief: update the display
@@ -383,11 +1191,29 @@ class EPD(scr.Screen):
  #          set the other memory area.
  ##
     def display_frame(self):
+        self.set_display_update()
+        self.activate_display()
+
+##
+ #  @brief: select the display update sequence started by
+ #          activate_display()
+ ##
+    def set_display_update(self):
         self.send_command(DISPLAY_UPDATE_CONTROL_2)
         self.send_data(0xC4)
+
+##
+ #  @brief: start the display update and wait for it to finish
+ #          set_display_update() must have been called first
+ ##
+    def activate_display(self):
         self.send_command(MASTER_ACTIVATION)
+        self.activation_time = time.time()
         self.send_command(TERMINATE_FRAME_READ_WRITE)
         self.wait_until_idle()
+        self.record_busy_time(time.time() - self.activation_time)
+        self.active_bank = 1 - self.active_bank
+        self.save_state()
 
 ##
  #  @brief: specify the memory area for data R/W
@@ -424,6 +1250,8 @@ class EPD(scr.Screen):
     def sleep(self):
         self.send_command(DEEP_SLEEP_MODE)
         self.wait_until_idle()
+        self.asleep = True
+        self.save_state()
 
 
     def clear_screen(self):
@@ -439,13 +1267,14 @@ class EPD(scr.Screen):
 
         # Update twice to put blank image in both memory areas
         # screen flashes when doing this
-        self.set_to_full_update()
-        self.update()
-        self.update()
+        with self._locked_panel():
+            self.set_to_full_update()
+            self.update(force=True)
+            self.update(force=True)
         
 
-        # Return to partial update mode
-        self.set_to_partial_update()
+            # Return to partial update mode
+            self.set_to_partial_update()
         
         
 
@@ -459,11 +1288,11 @@ def moving_box(epd):
 
     """
 
-    epd.screen.rect((20,20,30,30),fill=0,name='box')
+    epd.rect((20,20,30,30),fill=0,name='box')
     epd.update()
 
     for offset in range(0,100,10):
-        epd.screen['box'].args = [(20,20+offset,30,30+offset)]
+        epd.update_shape('box',args=[(20,20+offset,30,30+offset)])
         epd.update()
 
         
@@ -477,7 +1306,21 @@ def test_shapes(epd):
     epd.line((5,200,120,200),width=5)
     epd.ellipse((110,220,120,240),fill=255)
     epd.update()
-    
-    
-    
 
+
+def clock(epd,minutes=10):
+    """
+    Clock that changes exactly on the minute
+
+    """
+    epd.text((40,60),'--:--',fontsize=30,name='clock')
+    epd.update()
+
+    def set_time(epd):
+        t = time.localtime(deadline)
+        epd.text((40,60),time.strftime('%H:%M',t),fontsize=30,name='clock')
+
+    for i in range(minutes):
+        deadline = next_minute()
+        offset = epd.update_at(deadline,prepare=set_time)
+        print('Activation %.1f ms from deadline' % (1000 * offset))